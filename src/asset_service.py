@@ -0,0 +1,200 @@
+"""
+Cached, pre-compressed pages and static assets for the FastAPI application.
+"""
+
+import gzip
+import mimetypes
+import posixpath
+import threading
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+from urllib.parse import quote
+from jinja2 import Environment, FileSystemLoader
+from fastapi import Request
+from fastapi.responses import Response
+from config import STATIC_DIR, TEMPLATES_DIR, ASSET_CHECK_INTERVAL, ASSET_COMPRESS_MIN_SIZE, STATIC_MAX_AGE
+from http_cache import etag_matches, make_etag, not_modified
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always offered
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml", "font/ttf")
+
+
+class CachedAsset(NamedTuple):
+    """A rendered page or static file with all its encodings; sources are the files it was built from."""
+
+    media_type: str
+    version: str
+    bodies: dict[str, bytes]
+    sources: tuple
+    checked_at: float
+
+
+class AssetService:
+    """
+    In-memory cache of the static pages and assets.
+
+    Templates are rendered once and files are read once; every body is stored
+    together with its gzip (and, if installed, brotli) encoding and a version
+    hash. Requests only negotiate the encoding and answer 304 or hand out
+    bytes. An entry is rebuilt when the mtime or size of one of its source
+    files changed, checked at most every ``check_interval`` seconds. Pages link
+    to assets through ``static_url()``, which appends the version so those URLs
+    can be cached as immutable.
+    """
+
+    def __init__(self, static_dir: Optional[Path] = None, templates_dir: Optional[Path] = None, check_interval: float = ASSET_CHECK_INTERVAL):
+        self.static_dir = Path(static_dir or STATIC_DIR).resolve()
+        self.check_interval = check_interval
+        self.templates = Environment(loader=FileSystemLoader(str(templates_dir or TEMPLATES_DIR)), autoescape=True, auto_reload=True)
+        self.templates.globals["static_url"] = self.static_url
+        self._assets: dict[str, CachedAsset] = {}
+        self._lock = threading.RLock()
+        self._dependencies: Optional[list[Path]] = None
+
+    @staticmethod
+    def _stat(paths) -> tuple:
+        sources = []
+        for path in paths:
+            try:
+                stat = path.stat()
+                sources.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                sources.append((path, None, None))
+        return tuple(sources)
+
+    @staticmethod
+    def _encode(body: bytes, media_type: str) -> dict[str, bytes]:
+        """Pre-compress a body; encodings that do not make it smaller are left out."""
+        bodies = {"identity": body}
+        if len(body) >= ASSET_COMPRESS_MIN_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body, quality=11)
+            bodies.update((encoding, data) for encoding, data in candidates.items() if len(data) < len(body))
+        return bodies
+
+    def _get(self, key: str, build: Callable[[], tuple[bytes, str, list[Path]]], fresh: bool = False) -> Optional[CachedAsset]:
+        """
+        Get a cached entry, (re)building it if it is missing or one of its sources changed.
+
+        Args:
+            key: Cache key of the entry
+            build: Returns (body, media_type, source paths); raises FileNotFoundError if the entry is gone
+            fresh: Check the sources even if they were checked less than check_interval ago
+
+        Returns:
+            CachedAsset or None if the entry does not exist
+        """
+        now = time.monotonic()
+        asset = self._assets.get(key)
+        if asset is not None and not fresh and now - asset.checked_at < self.check_interval:
+            return asset
+
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None and self._stat(path for path, _, _ in asset.sources) == asset.sources:
+                asset = asset._replace(checked_at=now)
+            else:
+                try:
+                    body, media_type, paths = build()
+                except FileNotFoundError:
+                    self._assets.pop(key, None)
+                    return None
+                asset = CachedAsset(media_type, make_etag(body).strip('"')[:16], self._encode(body, media_type), self._stat(paths), now)
+            self._assets[key] = asset
+            return asset
+
+    def static(self, name: str, fresh: bool = False) -> Optional[CachedAsset]:
+        """Get a file of the static directory, or None if it does not exist or the name is not canonical."""
+        # Aliases such as "./a.css" or "b/../a.css" would each be cached as another copy
+        if not name or posixpath.normpath(name) != name or name == ".." or name.startswith(("/", "../")):
+            return None
+
+        def build():
+            path = (self.static_dir / name).resolve()
+            if not path.is_relative_to(self.static_dir) or not path.is_file():
+                raise FileNotFoundError(name)
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            return path.read_bytes(), media_type, [path]
+
+        return self._get(f"static:{name}", build, fresh)
+
+    def page(self, name: str) -> CachedAsset:
+        """Get a rendered template; it is re-rendered if the template or a linked asset changed."""
+
+        def build():
+            template = self.templates.get_template(name)
+            self._dependencies = []
+            try:
+                body = template.render().encode("utf-8")
+                return body, "text/html", [Path(template.filename), *self._dependencies]
+            finally:
+                self._dependencies = None
+
+        return self._get(f"page:{name}", build)
+
+    def static_url(self, name: str) -> str:
+        """URL of a static file including its version, for use in templates."""
+        # While rendering, the page must embed the version of the file as it is now
+        asset = self.static(name, fresh=self._dependencies is not None)
+        if asset is None:
+            return f"/static/{quote(name)}"
+        if self._dependencies is not None:
+            self._dependencies.append(asset.sources[0][0])
+        return f"/static/{quote(name)}?v={asset.version}"
+
+    def warm(self):
+        """Render all templates up front (which also loads the assets they link to)."""
+        for name in self.templates.list_templates():
+            self.page(name)
+
+    @staticmethod
+    def _negotiate(accept_encoding: str, bodies: dict[str, bytes]) -> str:
+        accepted = {}
+        for item in accept_encoding.split(","):
+            coding, _, params = item.partition(";")
+            params = params.strip()
+            try:
+                q = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                q = 0.0
+            accepted[coding.strip().lower()] = q
+        for encoding in ("br", "gzip"):
+            if encoding in bodies and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+    def response(self, request: Request, asset: CachedAsset, cache_control: str = "no-cache") -> Response:
+        """
+        Build the response for a cached entry.
+
+        Args:
+            request: Incoming request (Accept-Encoding and If-None-Match are honored)
+            asset: Entry to send
+            cache_control: Cache-Control header value
+
+        Returns:
+            Response: 200 with the best encoding the client accepts, or 304
+        """
+        encoding = self._negotiate(request.headers.get("accept-encoding", ""), asset.bodies)
+        headers = {"ETag": f'"{asset.version}-{encoding}"', "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return not_modified(headers)
+        return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+    def static_response(self, request: Request, asset: CachedAsset) -> Response:
+        """Response for a static file; versioned URLs are cached as immutable, all others are revalidated."""
+        if request.query_params.get("v") == asset.version:
+            return self.response(request, asset, f"public, max-age={STATIC_MAX_AGE}, immutable")
+        return self.response(request, asset)
+
+
+# Singleton instance
+asset_service = AssetService()
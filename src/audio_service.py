@@ -4,136 +4,535 @@ Audio streaming service for the FastAPI application.
 
 import os
 import re
+import mmap
+import secrets
+import anyio
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
 from pathlib import Path
-from typing import Generator, Optional
+from typing import AsyncGenerator, BinaryIO, Callable, NamedTuple, Optional
 from fastapi import HTTPException, Request
-from fastapi.responses import StreamingResponse
-from config import DATA_DIR
+from fastapi.responses import Response
+from starlette.types import Receive, Scope, Send
+from config import DATA_DIR, AUDIO_MAX_RANGES, AUDIO_VARIANTS, AUDIO_SAVE_DATA_VARIANTS, HLS_PLAYLIST_MAX_AGE, HLS_SEGMENT_MAX_AGE
+from http_cache import etag_matches
+from hot_cache_service import HotCacheService, HotEntry, hot_cache_service
+
+HLS_FILE_PATTERN = re.compile(r"^[\w-]+\.(m3u8|ts)$")
+HLS_MEDIA_TYPES = {"m3u8": "application/vnd.apple.mpegurl", "ts": "video/mp2t"}
+
+
+class FileValidator(NamedTuple):
+    """Size and validators of one opened audio file."""
+
+    size: int
+    mtime: float
+    etag: str
+    last_modified: str
+
+
+class AudioSource(NamedTuple):
+    """What a response sends from: the opened file, or the mapped entry of a hot file."""
+
+    path: Path
+    validator: FileValidator
+    file: Optional[BinaryIO] = None
+    entry: Optional[HotEntry] = None
+
+
+class AudioFileResponse(Response):
+    """
+    Response for one or more byte ranges of an audio file.
+
+    The file is opened before the headers are built and the response sends
+    from that descriptor (or from the memory-mapped buffer of a hot file), so
+    the bytes always match the announced size even if the file is replaced
+    meanwhile; the response closes the file when it is done. It hands the
+    descriptor to the server via the ASGI zero-copy extension (``os.sendfile``
+    under the hood) or the path via the pathsend extension when the server
+    advertises them and the path still names the opened file. Otherwise ranges
+    are copied out of the buffer or read with an async chunked reader.
+    ``release`` is called once the response is done with the buffer.
+    Copies out of the buffer larger than ``INLINE_COPY_SIZE`` run on a worker
+    thread, so a page the kernel evicted despite MADV_WILLNEED faults in there
+    and not on the event loop. Several ranges are sent as a
+    ``multipart/byteranges`` body.
+    """
+
+    INLINE_COPY_SIZE = 64 * 1024
+    READ_AHEAD_CHUNKS = 4
+
+    def __init__(
+        self,
+        file_path: Path,
+        ranges: list[tuple[int, int]],
+        chunk_size: int,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        boundary: Optional[str] = None,
+        part_headers: Optional[list[bytes]] = None,
+        file: Optional[BinaryIO] = None,
+        buffer: Optional[mmap.mmap] = None,
+        release: Optional[Callable[[], None]] = None,
+    ):
+        self.file_path = file_path
+        self.file = file
+        self.buffer = buffer
+        self.release = release
+        self.ranges = ranges
+        self.chunk_size = chunk_size
+        self.boundary = boundary
+        self.part_headers = part_headers or []
+        self.status_code = status_code
+        self.media_type = None
+        self.background = None
+        self.init_headers(headers)
+
+    async def _read_chunks(self, fd: int, byte_start: int, byte_end: int) -> AsyncGenerator[bytes, None]:
+        """
+        Read a byte range with positional reads off the event loop, READ_AHEAD_CHUNKS chunks per thread hop.
+
+        Args:
+            fd: Open file descriptor
+            byte_start: First byte position
+            byte_end: Last byte position (inclusive)
+
+        Yields:
+            bytes: File chunks
+        """
+        position = byte_start
+        remaining = byte_end - byte_start + 1
+        while remaining > 0:
+            span = await anyio.to_thread.run_sync(os.pread, fd, min(remaining, self.chunk_size * self.READ_AHEAD_CHUNKS), position)
+            if not span:
+                break
+            position += len(span)
+            remaining -= len(span)
+            for offset in range(0, len(span), self.chunk_size):
+                yield span[offset : offset + self.chunk_size]
+
+    async def _send_range(self, send: Send, extensions: dict, byte_start: int, byte_end: int, more_body: bool):
+        count = byte_end - byte_start + 1
+        if self.buffer is None and "http.response.zerocopysend" in extensions:
+            await send({"type": "http.response.zerocopysend", "file": self.file, "offset": byte_start, "count": count, "more_body": more_body})
+            return
+        if self.buffer is not None:
+            for position in range(byte_start, byte_end + 1, self.chunk_size):
+                window = slice(position, min(position + self.chunk_size, byte_end + 1))
+                if window.stop - window.start > self.INLINE_COPY_SIZE:
+                    body = await anyio.to_thread.run_sync(self.buffer.__getitem__, window)
+                else:
+                    body = self.buffer[window]
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+            if not more_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        async for chunk in self._read_chunks(self.file.fileno(), byte_start, byte_end):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not more_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _stream(self, scope: Scope, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or not self.ranges:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.boundary is None:
+            byte_start, byte_end = self.ranges[0]
+            if self.file is not None and "http.response.pathsend" in extensions and byte_start == 0 and self._path_is_file(byte_end + 1):
+                await send({"type": "http.response.pathsend", "path": str(self.file_path)})
+                return
+            await self._send_range(send, extensions, byte_start, byte_end, more_body=False)
+            return
+
+        for (byte_start, byte_end), part_header in zip(self.ranges, self.part_headers):
+            await send({"type": "http.response.body", "body": part_header, "more_body": True})
+            await self._send_range(send, extensions, byte_start, byte_end, more_body=True)
+            await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": f"--{self.boundary}--\r\n".encode(), "more_body": False})
+
+    def _path_is_file(self, size: int) -> bool:
+        """True if the path still names the opened file and it has the announced size."""
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return False
+        return os.path.samestat(stat, os.fstat(self.file.fileno())) and stat.st_size == size
+
+    async def _listen_for_disconnect(self, receive: Receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        async with anyio.create_task_group() as task_group:
+
+            async def wrap(func):
+                await func()
+                task_group.cancel_scope.cancel()
+
+            try:
+                task_group.start_soon(wrap, partial(self._stream, scope, send))
+                await wrap(partial(self._listen_for_disconnect, receive))
+            finally:
+                if self.file is not None:
+                    self.file.close()
+                if self.release is not None:
+                    self.release()
 
 
 class AudioService:
     """Service for handling audio file operations and streaming."""
-    
-    def __init__(self):
+
+    def __init__(self, hot_cache: HotCacheService = hot_cache_service):
         self.data_dir = Path(DATA_DIR)
+        self.hot_cache = hot_cache
         self.chunk_size = 1024 * 1024  # 1MB chunks
-    
-    def _create_file_iterator(
-        self, 
-        file_path: Path, 
-        byte_start: int = 0, 
-        byte_end: Optional[int] = None
-    ) -> Generator[bytes, None, None]:
-        """
-        Create a file iterator for streaming audio files with range support.
-        
+        self.media_type = "audio/mpeg"
+        self.variants = AUDIO_VARIANTS
+        self.save_data_variants = AUDIO_SAVE_DATA_VARIANTS
+        self.max_ranges = AUDIO_MAX_RANGES
+
+    @staticmethod
+    def _validator(stat: os.stat_result) -> FileValidator:
+        return FileValidator(
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            etag=f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+            last_modified=formatdate(stat.st_mtime, usegmt=True),
+        )
+
+    def _open(self, file_path: Path, count_access: bool) -> AudioSource:
+        """
+        Open a file and get size, ETag and Last-Modified of exactly that file; blocking, so run it on a worker thread.
+
         Args:
             file_path: Path to the audio file
-            byte_start: Starting byte position
-            byte_end: Ending byte position (optional)
-            
-        Yields:
-            bytes: File chunks
+            count_access: Count the request towards the hot cache, which may map the file
+
+        Returns:
+            AudioSource: The open file or, if it is hot, its mapped entry
+
+        Raises:
+            HTTPException: If file doesn't exist
         """
-        with open(file_path, "rb") as file:
-            file.seek(byte_start)
-            if byte_end is not None:
-                remaining = byte_end - byte_start + 1
-                while remaining:
-                    to_read = min(remaining, self.chunk_size)
-                    chunk = file.read(to_read)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-            else:
-                while chunk := file.read(self.chunk_size):
-                    yield chunk
-    
-    def _parse_range_header(self, range_header: str, file_size: int) -> tuple[int, int]:
+        try:
+            file = open(file_path, "rb")
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise HTTPException(status_code=404, detail="Audio file not found")
+        try:
+            stat = os.fstat(file.fileno())
+            entry = self.hot_cache.get(file_path, file, stat) if count_access else None
+        except BaseException:
+            file.close()
+            raise
+        if entry is not None:
+            file.close()
+            return AudioSource(file_path, self._validator(stat), entry=entry)
+        return AudioSource(file_path, self._validator(stat), file=file)
+
+    async def _source(self, file_path: Path, request: Request) -> AudioSource:
+        """Get what to send for a file: a recently checked hot entry straight from memory, otherwise open it on a worker thread."""
+        if request.method == "GET":
+            entry = self.hot_cache.lookup(file_path)
+            if entry is not None:
+                return AudioSource(file_path, self._validator(entry.stat), entry=entry)
+        return await anyio.to_thread.run_sync(self._open, file_path, request.method == "GET")
+
+    def _close(self, source: AudioSource):
+        """Give up a source without sending it."""
+        if source.file is not None:
+            source.file.close()
+        if source.entry is not None:
+            self.hot_cache.release(source.entry)
+
+    def _parse_range_header(self, range_header: str, file_size: int) -> Optional[list[tuple[int, int]]]:
         """
-        Parse HTTP Range header.
-        
+        Parse an HTTP Range header (RFC 7233 byte ranges).
+
+        Supports ``first-last``, open-ended ``first-`` and suffix ``-length``
+        specs, clamps them to the file and merges overlapping or adjacent ones.
+
         Args:
             range_header: Range header value
             file_size: Total file size
-            
+
         Returns:
-            tuple: (byte_start, byte_end)
-        """
-        byte_start = 0
-        byte_end = file_size - 1
-        
-        match = re.search(r"bytes=(\d+)-(\d*)", range_header)
-        if match:
-            byte_start = int(match.group(1))
-            if match.group(2):
-                byte_end = int(match.group(2))
-        
-        return byte_start, byte_end
-    
+            list: Satisfiable (byte_start, byte_end) pairs, empty if none is satisfiable,
+                or None if the header is malformed and must be ignored
+        """
+        unit, _, range_set = range_header.partition("=")
+        if unit.strip().lower() != "bytes" or not range_set.strip():
+            return None
+
+        ranges = []
+        for spec in range_set.split(","):
+            spec = spec.strip()
+            if not spec:
+                continue
+            first, sep, last = spec.partition("-")
+            first, last = first.strip(), last.strip()
+            if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+                return None
+
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length == 0:
+                    continue
+                ranges.append((max(file_size - length, 0), file_size - 1))
+                continue
+
+            byte_start = int(first)
+            if last and int(last) < byte_start:
+                return None
+            if byte_start >= file_size:
+                continue
+            byte_end = min(int(last), file_size - 1) if last else file_size - 1
+            ranges.append((byte_start, byte_end))
+
+        if not ranges:
+            return []
+
+        ranges.sort()
+        merged = [ranges[0]]
+        for byte_start, byte_end in ranges[1:]:
+            last_start, last_end = merged[-1]
+            if byte_start <= last_end + 1:
+                merged[-1] = (last_start, max(last_end, byte_end))
+            else:
+                merged.append((byte_start, byte_end))
+        return merged
+
+    def _if_range_matches(self, if_range: str, validator: FileValidator) -> bool:
+        """
+        Evaluate an If-Range header; Range is only honoured if it matches.
+
+        Args:
+            if_range: If-Range header value (strong ETag or HTTP date)
+            validator: Current validators of the file
+
+        Returns:
+            bool: True if the client's copy is current
+        """
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == validator.etag
+        return if_range == validator.last_modified
+
+    def _is_not_modified(self, request: Request, validator: FileValidator) -> bool:
+        """Evaluate If-None-Match, falling back to If-Modified-Since."""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, validator.etag)
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(validator.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _accepts(accept: Optional[str], media_type: str, explicit: bool = False) -> bool:
+        """
+        Check whether an Accept header allows a media type.
+
+        Args:
+            accept: Raw Accept header value
+            media_type: Media type to check
+            explicit: Only count an exact mention, not audio/* or */*
+
+        Returns:
+            bool: True if the type is acceptable
+        """
+        if not accept:
+            return not explicit
+        qualities = {}
+        for item in accept.split(","):
+            value, _, params = item.partition(";")
+            q = 1.0
+            for param in params.split(";"):
+                name, _, number = param.strip().partition("=")
+                if name == "q":
+                    try:
+                        q = float(number)
+                    except ValueError:
+                        q = 0.0
+            qualities[value.strip().lower()] = q
+        for candidate in (media_type, f"{media_type.split('/')[0]}/*", "*/*")[: 1 if explicit else 3]:
+            if candidate in qualities:
+                return qualities[candidate] > 0
+        return False
+
+    async def _select_variant(self, theme: str, title: str, request: Request) -> tuple[str, AudioSource]:
+        """
+        Pick the file to send for a story.
+
+        A ``quality`` query parameter names a variant (or ``original``);
+        otherwise clients sending ``Save-Data: on`` get the first low-bandwidth
+        variant their Accept header allows. Missing variants fall back to the
+        next candidate and finally to the original mp3.
+
+        Returns:
+            tuple: (media type, source)
+
+        Raises:
+            HTTPException: If the story doesn't exist
+        """
+        quality = request.query_params.get("quality")
+        if quality in self.variants:
+            candidates = [quality]
+        elif quality is None and request.headers.get("save-data", "").strip().lower() == "on":
+            accept = request.headers.get("accept")
+            candidates = [name for name in self.save_data_variants if self._accepts(accept, self.variants[name]["media_type"], self.variants[name].get("needs_accept", False))]
+        else:
+            candidates = []
+
+        for name in candidates:
+            variant = self.variants[name]
+            file_path = self.data_dir / theme / ".variants" / name / f"{title}.{variant['ext']}"
+            try:
+                return variant["media_type"], await self._source(file_path, request)
+            except HTTPException:
+                continue
+        return self.media_type, await self._source(self.data_dir / theme / f"{title}.mp3", request)
+
+    def _file_response(self, source: AudioSource, ranges: list[tuple[int, int]], **kwargs) -> AudioFileResponse:
+        """Response sending from the hot entry's buffer if there is one, otherwise from the open file."""
+        if source.entry is not None:
+            return AudioFileResponse(source.path, ranges, self.chunk_size, buffer=source.entry.buffer, release=partial(self.hot_cache.release, source.entry), **kwargs)
+        return AudioFileResponse(source.path, ranges, self.chunk_size, file=source.file, **kwargs)
+
+    def warm_hot_cache(self, top_stories: list[tuple[str, str, int]]):
+        """Map the most played stories up front; takes (theme, title, plays) rows from the playtime rollup."""
+        self.hot_cache.seed((self.data_dir / theme / f"{title}.mp3", plays) for theme, title, plays in top_stories)
+
     def get_audio_file_path(self, theme: str, title: str) -> Path:
         """
         Get the path to an audio file.
-        
+
         Args:
             theme: Theme name
             title: Audio title
-            
+
         Returns:
             Path: Path to the audio file
-            
+
         Raises:
             HTTPException: If file doesn't exist
         """
         file_path = self.data_dir / theme / f"{title}.mp3"
-        if not file_path.exists():
+        if not file_path.is_file():
             raise HTTPException(status_code=404, detail="Audio file not found")
         return file_path
-    
-    def stream_audio_file(self, theme: str, title: str, request: Request) -> StreamingResponse:
+
+    async def stream_audio_file(self, theme: str, title: str, request: Request) -> Response:
         """
-        Stream an audio file with support for HTTP Range requests.
-        
+        Stream an audio file (or a lower-bitrate variant of it) with support for HTTP Range and conditional requests.
+
         Args:
             theme: Theme name
             title: Audio title
             request: FastAPI request object
-            
+
         Returns:
-            StreamingResponse: Streaming response with audio data
+            Response: 200/206 audio response, 304 if the client's copy is current,
+                or 416 if no requested range is satisfiable
         """
-        file_path = self.get_audio_file_path(theme, title)
-        file_size = file_path.stat().st_size
+        media_type, source = await self._select_variant(theme, title, request)
+        validator = source.validator
+        file_size = validator.size
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": validator.etag,
+            "Last-Modified": validator.last_modified,
+            "Vary": "Accept, Save-Data",
+        }
+
+        if self._is_not_modified(request, validator):
+            self._close(source)
+            return Response(status_code=304, headers=headers)
+
         range_header = request.headers.get("range")
-        
-        if range_header:
-            byte_start, byte_end = self._parse_range_header(range_header, file_size)
-            
-            headers = {
-                "Content-Range": f"bytes {byte_start}-{byte_end}/{file_size}",
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(byte_end - byte_start + 1),
-                "Content-Type": "audio/mpeg",
-            }
-            
-            return StreamingResponse(
-                self._create_file_iterator(file_path, byte_start, byte_end),
-                status_code=206,
-                headers=headers
-            )
-        else:
-            headers = {
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(file_size),
-                "Content-Type": "audio/mpeg",
-            }
-            
-            return StreamingResponse(
-                self._create_file_iterator(file_path),
-                headers=headers
-            )
+        if_range = request.headers.get("if-range")
+        ranges = None
+        if range_header and request.method == "GET" and (if_range is None or self._if_range_matches(if_range, validator)):
+            ranges = self._parse_range_header(range_header, file_size)
+            if ranges is not None and len(ranges) > self.max_ranges:
+                ranges = None
+
+        if ranges is not None and not ranges:
+            headers["Content-Range"] = f"bytes */{file_size}"
+            self._close(source)
+            return Response(status_code=416, headers=headers)
+
+        if ranges is None:
+            headers["Content-Length"] = str(file_size)
+            headers["Content-Type"] = media_type
+            return self._file_response(source, [(0, file_size - 1)] if file_size else [], headers=headers)
+
+        if len(ranges) == 1:
+            byte_start, byte_end = ranges[0]
+            headers["Content-Range"] = f"bytes {byte_start}-{byte_end}/{file_size}"
+            headers["Content-Length"] = str(byte_end - byte_start + 1)
+            headers["Content-Type"] = media_type
+            return self._file_response(source, ranges, status_code=206, headers=headers)
+
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            f"--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {byte_start}-{byte_end}/{file_size}\r\n\r\n".encode() for byte_start, byte_end in ranges
+        ]
+        content_length = sum(len(part) + byte_end - byte_start + 1 + 2 for part, (byte_start, byte_end) in zip(part_headers, ranges)) + len(f"--{boundary}--\r\n")
+        headers["Content-Length"] = str(content_length)
+        headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        return self._file_response(source, ranges, status_code=206, headers=headers, boundary=boundary, part_headers=part_headers)
+
+    async def stream_hls_file(self, theme: str, title: str, name: str, request: Request) -> Response:
+        """
+        Serve a playlist or segment of a story's HLS rendition.
+
+        Segments are cached as immutable (their names carry the source
+        version); playlists keep a stable URL and are revalidated via ETag.
+
+        Args:
+            theme: Theme name
+            title: Audio title
+            name: index.m3u8 or a segment file name
+            request: FastAPI request object
+
+        Returns:
+            Response: 200 with the file, or 304 if the client's copy is current
+
+        Raises:
+            HTTPException: If the file doesn't exist
+        """
+        match = HLS_FILE_PATTERN.match(name)
+        if match is None or theme.startswith(".") or title.startswith("."):
+            raise HTTPException(status_code=404, detail="HLS file not found")
+
+        file_path = self.data_dir / theme / ".hls" / title / name
+        source = await self._source(file_path, request)
+        validator = source.validator
+        extension = match.group(1)
+        max_age = HLS_PLAYLIST_MAX_AGE if extension == "m3u8" else f"{HLS_SEGMENT_MAX_AGE}, immutable"
+        headers = {
+            "ETag": validator.etag,
+            "Last-Modified": validator.last_modified,
+            "Cache-Control": f"public, max-age={max_age}",
+        }
+        if self._is_not_modified(request, validator):
+            self._close(source)
+            return Response(status_code=304, headers=headers)
+
+        headers["Content-Length"] = str(validator.size)
+        headers["Content-Type"] = HLS_MEDIA_TYPES[extension]
+        return self._file_response(source, [(0, validator.size - 1)] if validator.size else [], headers=headers)
 
 
 # Singleton instance
-audio_service = AudioService()
\ No newline at end of file
+audio_service = AudioService()
@@ -0,0 +1,531 @@
+"""
+Reproducible benchmarks against a synthetic library.
+
+    python benchmark.py server                      # run and compare with the stored baseline
+    python benchmark.py server --save-baseline      # run and store the result as the new baseline
+    python benchmark.py server --themes 20 --stories 100 --playtime 1000000 --workers 2
+    python benchmark.py pipeline --stories 200 --profile quota --time-scale 0.05 --concurrency 40
+"""
+
+from config import (
+    SRC_DIR,
+    ICON_SIZES,
+    AVAILABLE_THEMES,
+    DEFAULT_MODEL,
+    DEFAULT_WORD_LIMIT,
+    DEFAULT_TARGET_GROUP,
+    JOB_CONCURRENCY,
+    PIPELINE_LLM_CONCURRENCY,
+    PIPELINE_TTS_SUBMIT_CONCURRENCY,
+    PIPELINE_TTS_INFLIGHT,
+    PIPELINE_TRANSCODE_CONCURRENCY,
+    PIPELINE_POLL_INTERVAL,
+    TTS_RATE_LIMIT,
+    TTS_TIME_WINDOW,
+    TTS_MODE,
+)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from urllib.parse import quote
+from pathlib import Path
+import multiprocessing
+import http.client
+import subprocess
+import threading
+import argparse
+import platform
+import tempfile
+import base64
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+# Next to the script rather than in DATA_DIR, which the server publishes under /data
+BASELINE_DIR = SRC_DIR / "benchmarks"
+BENCH_PASSWORD = "bench"
+RANGE_BYTES = 256 * 1024  # bytes requested per ranged audio request (a typical player chunk)
+
+# Silent MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, mono, 1152 samples
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+# Synthetic data
+def make_library(data_dir, themes, stories, story_seconds, playtime_rows, days=90, seed=1):
+    """
+    Create theme directories with silent mp3 stories and a playtime history.
+
+    All stories share one file through hard links (copies where links are not
+    supported), so the library costs one story on disk; audio reads therefore
+    come from the page cache like hot files do in production. Playtime events are
+    spread over the last days and go through DatabaseService so the rollups are
+    filled the same way the ingest worker fills them.
+    """
+    data_dir = Path(data_dir)
+    source = data_dir / ".story.mp3"
+    with open(source, "wb") as f:
+        f.write(MP3_FRAME * int(story_seconds / MP3_FRAME_SECONDS))
+
+    library = []
+    for t in range(themes):
+        theme_dir = data_dir / f"Thema {t:02d}"
+        theme_dir.mkdir(parents=True, exist_ok=True)
+        for s in range(stories):
+            path = theme_dir / f"Geschichte {s:04d}.mp3"
+            try:
+                os.link(source, path)
+            except OSError:
+                shutil.copyfile(source, path)
+            library.append((theme_dir.name, path.stem))
+
+    process = _spawn(data_dir, _fill_playtime, data_dir, library, story_seconds, playtime_rows, days, seed)
+    process.join()
+    if process.exitcode:
+        raise RuntimeError(f"filling the playtime history failed with exit code {process.exitcode}")
+    return library
+
+
+def _fill_playtime(data_dir, library, story_seconds, playtime_rows, days, seed):
+    """Write the synthetic playtime history; runs in a process spawned by make_library."""
+    # Imported here so the db_service singleton is created in the scratch DATA_DIR
+    from db_service import DatabaseService
+
+    rng = random.Random(seed)
+    db = DatabaseService(data_dir / "database.db")
+    now = datetime.now(timezone.utc)
+    for start in range(0, playtime_rows, 10000):
+        events = []
+        for _ in range(min(10000, playtime_rows - start)):
+            theme, title = library[_popular_index(rng, len(library))]
+            timestamp = (now - timedelta(seconds=rng.randrange(days * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+            events.append((theme, title, rng.randrange(1, max(int(story_seconds), 2)), timestamp))
+        db.track_playtime_batch(events)
+    db.pool.close_all()
+
+
+def _spawn(data_dir, target, *args):
+    """Start target in a fresh interpreter that reads DATA_DIR=data_dir when it imports config."""
+    previous = os.environ.get("DATA_DIR")
+    os.environ["DATA_DIR"] = str(data_dir)
+    try:
+        process = multiprocessing.get_context("spawn").Process(target=target, args=args)
+        process.start()
+    finally:
+        if previous is None:
+            del os.environ["DATA_DIR"]
+        else:
+            os.environ["DATA_DIR"] = previous
+    return process
+
+
+def _popular_index(rng, n):
+    """Skewed choice: a few stories get most of the plays, like in production."""
+    return int(n * rng.random() ** 3)
+
+
+# Server process
+def start_server(data_dir, port, workers, timeout=300):
+    env = {**os.environ, "DATA_DIR": str(data_dir), "PASSWORD": BENCH_PASSWORD}
+    command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=SRC_DIR, env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/api/themes")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"server did not become ready within {timeout} seconds")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def rss_bytes(pid):
+    """Resident memory of a process and all its descendants (uvicorn workers), read from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+# Load generation
+def scenarios(library, sizes):
+    """Request factories per scenario; each returns (method, path, headers, body)."""
+    auth = {"Authorization": "Basic " + base64.b64encode(f"admin:{BENCH_PASSWORD}".encode()).decode()}
+    icons = [f"/icon/{size}.png" for size in ICON_SIZES] + ["/favicon.ico"]
+    periods = ["24h", "7d", "30d", "alltime"]
+
+    def themes(rng):
+        return "GET", "/api/themes", {}, None
+
+    def audio_range(rng):
+        theme, title = library[_popular_index(rng, len(library))]
+        start = rng.randrange(max(sizes[(theme, title)] - RANGE_BYTES, 1))
+        return "GET", f"/api/audio/{quote(theme)}/{quote(title)}", {"Range": f"bytes={start}-{start + RANGE_BYTES - 1}"}, None
+
+    def track_playtime(rng):
+        theme, title = library[_popular_index(rng, len(library))]
+        body = json.dumps({"theme": theme, "title": title, "duration": rng.randrange(1, 60)})
+        return "POST", "/api/track-playtime", {"Content-Type": "application/json"}, body
+
+    def admin_stats(rng):
+        return "GET", f"/api/admin/stats/{rng.choice(periods)}", auth, None
+
+    def icon(rng):
+        return "GET", rng.choice(icons), {}, None
+
+    return {"themes": themes, "audio_range": audio_range, "track_playtime": track_playtime, "admin_stats": admin_stats, "icons": icon}
+
+
+def _client(port, request, deadline, seed):
+    """One keep-alive connection sending requests back to back until the deadline."""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, statuses, received = [], Counter(), 0
+    while time.perf_counter() < deadline:
+        method, path, headers, body = request(rng)
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            received += len(response.read())
+            status = str(response.status)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            status = "error"
+        latencies.append(time.perf_counter() - t0)
+        statuses[status] += 1
+    conn.close()
+    return latencies, statuses, received
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+def run_scenario(port, request, concurrency, seconds, pid, seed=0):
+    """Drive one scenario with concurrent clients and sample the server's RSS while it runs."""
+    peak_rss, done = [rss_bytes(pid)], threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.25):
+            peak_rss[0] = max(peak_rss[0], rss_bytes(pid))
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    deadline = time.perf_counter() + seconds
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: _client(port, request, deadline, seed * 1000 + i), range(concurrency)))
+    done.set()
+    sampler.join()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    statuses = sum((result[1] for result in results), Counter())
+    received = sum(result[2] for result in results)
+    errors = sum(count for status, count in statuses.items() if status == "error" or status.startswith("5"))
+    rss = rss_bytes(pid)
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / seconds, 1),
+        "mb_per_s": round(received / seconds / 1e6, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p90_ms": round(_percentile(latencies, 0.90) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "errors": errors,
+        "statuses": dict(statuses),
+        "rss_mb": round(rss / 1e6, 1),
+        "peak_rss_mb": round(max(peak_rss[0], rss) / 1e6, 1),
+    }
+
+
+# Baseline
+def compare(results, baseline, tolerance):
+    """
+    Print the change of every metric against the baseline.
+
+    Returns:
+        list: Regressions (scenario, metric, before, after) beyond the tolerance
+    """
+    if results["params"] != baseline.get("params"):
+        print(f">>> baseline was recorded with different parameters: {baseline.get('params')}")
+    regressions = []
+    print(f"\n{'scenario':<16} {'metric':<12} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in (("rps", True), ("p50_ms", False), ("p99_ms", False), ("peak_rss_mb", False)):
+            old, new = before[metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            regressed = (-change if higher_is_better else change) > tolerance
+            if regressed:
+                regressions.append((name, metric, old, new))
+            print(f"{name:<16} {metric:<12} {old:>10} {new:>10} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def bench_server(args):
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix="zauberohren-bench-"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    params = {key: getattr(args, key) for key in ("themes", "stories", "story_seconds", "playtime", "workers", "concurrency", "seconds")}
+
+    process = None
+    try:
+        marker = data_dir / ".library.json"
+        library_params = {key: params[key] for key in ("themes", "stories", "story_seconds", "playtime")}
+        if marker.exists() and json.loads(marker.read_text()) == library_params:
+            library = [(d.name, f.stem) for d in sorted(data_dir.iterdir()) if d.is_dir() and not d.name.startswith(".") for f in sorted(d.glob("*.mp3"))]
+        else:
+            print(f">>> creating library in {data_dir}")
+            library = make_library(data_dir, args.themes, args.stories, args.story_seconds, args.playtime)
+            marker.write_text(json.dumps(library_params))
+        sizes = {(theme, title): (data_dir / theme / f"{title}.mp3").stat().st_size for theme, title in library}
+
+        process = start_server(data_dir, args.port, args.workers)
+        factories = scenarios(library, sizes)
+        results = {"params": params, "python": platform.python_version(), "machine": platform.machine(), "recorded": datetime.now().isoformat(timespec="seconds"), "scenarios": {}}
+        print(f"\n{'scenario':<16} {'req/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>8} {'peak MB':>8}")
+        for i, name in enumerate(args.scenarios):
+            run_scenario(args.port, factories[name], args.concurrency, args.warmup, process.pid, seed=i)
+            result = run_scenario(args.port, factories[name], args.concurrency, args.seconds, process.pid, seed=i)
+            results["scenarios"][name] = result
+            print(
+                f"{name:<16} {result['rps']:>9} {result['mb_per_s']:>8} {result['p50_ms']:>8} {result['p90_ms']:>8} {result['p99_ms']:>8} "
+                f"{result['errors']:>7} {result['rss_mb']:>8} {result['peak_rss_mb']:>8}"
+            )
+    finally:
+        if process is not None:
+            stop_server(process)
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"\n>>> baseline saved to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"\n>>> no baseline at {baseline_path}, run with --save-baseline to record one")
+        return 0
+    regressions = compare(results, json.loads(baseline_path.read_text()), args.tolerance)
+    print(f"\n>>> {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+# Generation pipeline
+def _run_pipeline(params, sender):
+    """
+    Run queued jobs through GenerationPipeline against stub backends and send back the measurements.
+
+    Runs in a spawned process whose DATA_DIR points at a scratch directory, so
+    the job queue, content cache and TTS rate limit bucket are the benchmark's
+    own; the modules below are imported here for the same reason.
+    """
+    from pipeline import GenerationPipeline
+    from job_queue import JobQueue, drain
+    from rate_limiter import TokenBucketRateLimiter
+    from stub_backends import STUB_PROFILES, install
+    import resource
+    import asyncio
+    import tts
+
+    scale = params["time_scale"]
+    profile = STUB_PROFILES[params["profile"]]._replace(**{key: params[key] for key in ("error_rate", "quota") if params[key] is not None})
+    stubs = install(profile, scale, params["word_limit"], seed=1)
+    tts.TTS_MODE = params["tts_mode"]
+    tts.tts_rate_limiter = TokenBucketRateLimiter("tts", rate=params["tts_rate"], per=TTS_TIME_WINDOW * scale)
+
+    queue = JobQueue(max_attempts=params["retries"] + 1, retry_delay=params["retry_delay"])
+    themes = AVAILABLE_THEMES
+    for i, theme in enumerate(themes):
+        queue.enqueue(theme, params["stories"] // len(themes) + (i < params["stories"] % len(themes)), DEFAULT_MODEL, params["word_limit"], DEFAULT_TARGET_GROUP)
+
+    pipeline = GenerationPipeline(
+        llm_concurrency=params["llm_concurrency"],
+        tts_submit_concurrency=params["tts_submit_concurrency"],
+        tts_inflight=params["tts_inflight"],
+        transcode_concurrency=params["transcode_concurrency"],
+        poll_interval=PIPELINE_POLL_INTERVAL * scale,
+    )
+    done = Counter()
+
+    def on_done(job, error):
+        done["ok" if error is None else "failed" if job["attempts"] >= job["max_attempts"] else "retried"] += 1
+
+    t0 = time.monotonic()
+    asyncio.run(drain(queue, pipeline, params["concurrency"], on_done=on_done))
+    elapsed = time.monotonic() - t0
+
+    timings = queue.stage_timings()
+    limiter = tts.tts_rate_limiter.stats()["process"]
+    sender.send(
+        {
+            "params": params,
+            "elapsed_seconds": round(elapsed, 1),
+            "stories": done["ok"],
+            "failed": done["failed"],
+            "retries": done["retried"],
+            "stories_per_hour": round(done["ok"] / elapsed * 3600, 1),
+            "simulated_stories_per_hour": round(done["ok"] / elapsed * 3600 * scale, 1),
+            "stages": {
+                stage: {
+                    "limit": pipeline.limits[stage],
+                    "busy_seconds": round(seconds, 1),
+                    "utilization": round(seconds / (elapsed * pipeline.limits[stage]), 3),
+                    "seconds_per_job": round(timings[stage]["seconds"] / timings[stage]["jobs"], 2) if stage in timings else None,
+                }
+                for stage, seconds in pipeline.stage_seconds.items()
+                if seconds
+            },
+            "backends": {name: stub.stats for name, stub in stubs.items()},
+            "rate_limiter": {"acquired": limiter["acquired"], "waited": limiter["waited"], "max_wait_seconds": round(limiter["max_wait_seconds"], 2)},
+            # ru_maxrss is in KiB on Linux; for children it is the largest single process (an ffmpeg)
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        }
+    )
+
+
+def bench_pipeline(args):
+    data_dir = Path(tempfile.mkdtemp(prefix="zauberohren-pipeline-"))
+    params = {
+        key: getattr(args, key)
+        for key in (
+            "stories",
+            "profile",
+            "error_rate",
+            "quota",
+            "time_scale",
+            "word_limit",
+            "tts_mode",
+            "tts_rate",
+            "concurrency",
+            "llm_concurrency",
+            "tts_submit_concurrency",
+            "tts_inflight",
+            "transcode_concurrency",
+            "retries",
+            "retry_delay",
+        )
+    }
+
+    receiver, sender = multiprocessing.get_context("spawn").Pipe(duplex=False)
+    process = _spawn(data_dir, _run_pipeline, params, sender)
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    shutil.rmtree(data_dir, ignore_errors=True)
+    if result is None:
+        print(f">>> benchmark process exited with code {process.exitcode}")
+        return 1
+
+    print(f"\n>>> {result['stories']} stories in {result['elapsed_seconds']} s ({result['failed']} failed, {result['retries']} retries)")
+    print(f"    {result['stories_per_hour']} stories/hour, {result['simulated_stories_per_hour']} at real backend latencies (time scale {args.time_scale})")
+    print(f"\n{'stage':<14} {'limit':>6} {'busy s':>9} {'utilization':>12} {'s/job':>8}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<14} {stats['limit']:>6} {stats['busy_seconds']:>9} {stats['utilization']:>12.1%} {stats['seconds_per_job'] or '-':>8}")
+    print(
+        "\n    backends: "
+        + ", ".join(f"{name} {stats['calls']} calls ({stats['errors']} errors, {stats['quota_exceeded']} over quota)" for name, stats in result["backends"].items())
+    )
+    limiter = result["rate_limiter"]
+    print(f"    tts rate limit: {limiter['waited']}/{limiter['acquired']} waited, max {limiter['max_wait_seconds']} s")
+    print(f"    peak memory: {result['peak_rss_mb']} MB, largest child process {result['peak_child_rss_mb']} MB")
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the server against a synthetic library")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    server = commands.add_parser("server", help="load test the hot HTTP endpoints")
+    server.add_argument("--themes", type=int, default=8)
+    server.add_argument("--stories", type=int, default=25, help="stories per theme")
+    server.add_argument("--story-seconds", type=int, default=600, help="length of every synthetic story")
+    server.add_argument("--playtime", type=int, default=100000, help="playtime events in the database")
+    server.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    server.add_argument("--concurrency", type=int, default=32, help="concurrent client connections")
+    server.add_argument("--seconds", type=float, default=10, help="measured duration per scenario")
+    server.add_argument("--warmup", type=float, default=2, help="unmeasured duration per scenario before the measurement")
+    server.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["themes", "audio_range", "track_playtime", "admin_stats", "icons"],
+        choices=["themes", "audio_range", "track_playtime", "admin_stats", "icons"],
+    )
+    server.add_argument("--port", type=int, default=8765)
+    server.add_argument("--data-dir", help="keep the synthetic library here and reuse it across runs (default: a temporary directory)")
+    server.add_argument("--baseline", default=str(BASELINE_DIR / "server.json"))
+    server.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    server.add_argument("--tolerance", type=float, default=0.15, help="relative change that counts as a regression")
+
+    pipeline = commands.add_parser("pipeline", help="run the generation pipeline against stub LLM/TTS/storage backends")
+    pipeline.add_argument("--stories", type=int, default=100)
+    pipeline.add_argument("--profile", default="realistic", choices=["instant", "realistic", "flaky", "quota"], help="latency, error and quota profile of the stubs")
+    pipeline.add_argument("--error-rate", type=float, help="override the profile's failure probability per call")
+    pipeline.add_argument("--quota", type=int, help="override the profile's calls per backend and minute")
+    pipeline.add_argument("--time-scale", type=float, default=0.1, help="multiply backend latencies, poll interval and quota/rate windows (ffmpeg time is not scaled)")
+    pipeline.add_argument("--word-limit", type=int, default=DEFAULT_WORD_LIMIT, help="words per stub story")
+    pipeline.add_argument("--tts-mode", default=TTS_MODE, choices=["long", "chunked"])
+    pipeline.add_argument("--tts-rate", type=int, default=TTS_RATE_LIMIT, help="TTS requests per rate limit window")
+    pipeline.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY, help="jobs in progress at once")
+    pipeline.add_argument("--llm-concurrency", type=int, default=PIPELINE_LLM_CONCURRENCY)
+    pipeline.add_argument("--tts-submit-concurrency", type=int, default=PIPELINE_TTS_SUBMIT_CONCURRENCY)
+    pipeline.add_argument("--tts-inflight", type=int, default=PIPELINE_TTS_INFLIGHT)
+    pipeline.add_argument("--transcode-concurrency", type=int, default=PIPELINE_TRANSCODE_CONCURRENCY)
+    pipeline.add_argument("--retries", type=int, default=3, help="retries per job before it is marked failed")
+    pipeline.add_argument("--retry-delay", type=float, default=1, help="base delay of the job queue's retry backoff")
+    pipeline.add_argument("--output", help="also write the results as JSON to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "server":
+        sys.exit(bench_server(args))
+    if args.command == "pipeline":
+        sys.exit(bench_pipeline(args))
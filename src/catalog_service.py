@@ -0,0 +1,207 @@
+"""
+Catalog index service for the FastAPI application.
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+from config import DATA_DIR, CATALOG_REFRESH_INTERVAL
+from http_cache import make_etag
+from metadata_service import MetadataService, metadata_service
+
+
+class CatalogService:
+    """
+    In-memory index of all stories, grouped by theme and kept current by polling directory mtimes.
+
+    With several workers one of them leads: it scans the library and writes
+    every new snapshot to a shared file. The others follow that file instead
+    of scanning, so the directories and the metadata index are only read and
+    written by one process; until the first snapshot appears they serve an
+    empty catalog.
+    """
+
+    def __init__(self, data_dir: Optional[Path] = None, refresh_interval: float = CATALOG_REFRESH_INTERVAL, metadata: MetadataService = metadata_service):
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.metadata = metadata
+        self.refresh_interval = refresh_interval
+        self._root_mtime: Optional[int] = None
+        self._theme_dirs: list[Path] = []
+        self._theme_mtimes: dict[str, int] = {}
+        self._themes: dict[str, list[dict]] = {}
+        self._body: Optional[bytes] = None
+        self._etag = ""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.shared_path: Optional[Path] = None
+        self.following = False
+        self._shared_key: Optional[tuple] = None
+        self._published = False
+
+    def _scan_theme(self, theme_dir: Path) -> list[dict]:
+        """
+        List all stories of one theme directory with their durations and whether an HLS rendition exists.
+
+        Args:
+            theme_dir: Directory containing the theme's mp3 files
+
+        Returns:
+            list: Story entries sorted by title
+        """
+        files = sorted(theme_dir.glob("*.mp3"))
+        try:
+            # The catalog only needs durations; run.py hashes when it scans
+            metadata = self.metadata.update(files, content_hash=False)
+        except Exception as e:
+            logging.error(f">>> metadata index update failed for {theme_dir.name}: {e}")
+            metadata = {}
+        stories = []
+        for f in files:
+            entry = metadata.get(str(f))
+            duration = round(entry.duration, 1) if entry is not None and entry.duration is not None else None
+            hls = (theme_dir / ".hls" / f.stem / "index.m3u8").exists()
+            stories.append({"titel": f.stem, "path": str(f), "duration": duration, "hls": hls})
+        return stories
+
+    def _publish(self):
+        """Serialize the grouped catalog once so requests only hand out bytes."""
+        themes = {theme: self._themes[theme] for theme in sorted(self._themes) if self._themes[theme]}
+        body = json.dumps(themes, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._body = body
+        self._etag = make_etag(body)
+        if self.shared_path is not None and not self.following:
+            self.shared_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.shared_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(body)
+            os.replace(tmp_path, self.shared_path)
+            self._published = True
+
+    def _load_shared(self) -> Optional[bool]:
+        """
+        Adopt the snapshot the leading worker published, if it changed.
+
+        Returns:
+            bool: True if the catalog changed, None if nothing has been published yet
+        """
+        try:
+            stat = self.shared_path.stat()
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key == self._shared_key:
+            return False
+        body = self.shared_path.read_bytes()
+        self._themes = json.loads(body)
+        self._body = body
+        self._etag = make_etag(body)
+        self._shared_key = key
+        return True
+
+    def refresh(self) -> bool:
+        """
+        Bring the index up to date, rescanning only directories whose mtime changed.
+
+        Returns:
+            bool: True if the catalog changed
+        """
+        with self._lock:
+            if self.following:
+                changed = self._load_shared()
+                if changed is None and self._body is None:
+                    # Never scan here: that would hash the library and write the metadata index from every worker
+                    self._themes = {}
+                    self._body = b"{}"
+                    self._etag = make_etag(self._body)
+                return bool(changed)
+
+            changed = False
+            root_mtime = self.data_dir.stat().st_mtime_ns
+            if root_mtime != self._root_mtime:
+                self._root_mtime = root_mtime
+                self._theme_dirs = sorted(d for d in self.data_dir.iterdir() if d.is_dir() and not d.name.startswith("."))
+                names = {d.name for d in self._theme_dirs}
+                for removed in set(self._themes) - names:
+                    del self._themes[removed]
+                    self._theme_mtimes.pop(removed, None)
+                    changed = True
+
+            for theme_dir in self._theme_dirs:
+                try:
+                    mtime = theme_dir.stat().st_mtime_ns
+                except FileNotFoundError:
+                    # Theme vanished between listings; the next root change cleans it up
+                    continue
+                if self._theme_mtimes.get(theme_dir.name) != mtime:
+                    self._theme_mtimes[theme_dir.name] = mtime
+                    stories = self._scan_theme(theme_dir)
+                    if stories != self._themes.get(theme_dir.name):
+                        self._themes[theme_dir.name] = stories
+                        changed = True
+
+            if changed or self._body is None or (self.shared_path is not None and not self._published):
+                self._publish()
+            return changed
+
+    def snapshot(self) -> tuple[bytes, str]:
+        """
+        Get the pre-serialized catalog.
+
+        Returns:
+            tuple: (JSON body, ETag)
+        """
+        if self._body is None:
+            self.refresh()
+        return self._body, self._etag
+
+    def themes(self) -> dict[str, list[dict]]:
+        """Get the grouped catalog as Python objects."""
+        if self._body is None:
+            self.refresh()
+        return {theme: list(stories) for theme, stories in self._themes.items() if stories}
+
+    def lead(self, shared_path: Path):
+        """Scan the library from now on and publish every snapshot to shared_path for the other workers."""
+        with self._lock:
+            self.shared_path = Path(shared_path)
+            self.following = False
+            self._published = False
+            # The index may have been adopted from the previous leader; rescan everything
+            self._root_mtime = None
+            self._theme_mtimes = {}
+
+    def follow(self, shared_path: Path):
+        """Adopt the snapshots another worker publishes to shared_path instead of scanning (the catalog is empty until one exists)."""
+        with self._lock:
+            self.shared_path = Path(shared_path)
+            self.following = True
+            self._shared_key = None
+
+    def _watch(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f">>> catalog refresh failed: {e}")
+
+    def start(self):
+        """Build the index and start the background change detection."""
+        self.refresh()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background change detection."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.refresh_interval)
+            self._thread = None
+
+
+# Singleton instance
+catalog_service = CatalogService()
@@ -0,0 +1,143 @@
+from config import GOOGLE_PROJECT, PIPELINE_LLM_CONCURRENCY
+from requests.adapters import HTTPAdapter
+import threading
+import requests
+import logging
+import os
+
+
+def _http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(PIPELINE_LLM_CONCURRENCY, 10))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _check_http(session):
+    domain = os.environ.get("DOMAIN_WRAPPER")
+    session.get(f"https://{domain}/health/liveliness", timeout=5).raise_for_status()
+
+
+def _tts_client():
+    from google.cloud import texttospeech
+
+    return texttospeech.TextToSpeechLongAudioSynthesizeClient()
+
+
+def _tts_short_client():
+    from google.cloud import texttospeech
+
+    return texttospeech.TextToSpeechClient()
+
+
+def _storage_client():
+    from google.cloud import storage
+
+    return storage.Client(project=GOOGLE_PROJECT)
+
+
+class ClientProvider:
+    """
+    Long-lived clients for the LLM gateway, Text-to-Speech and Cloud Storage.
+
+    Clients are created lazily once per process (auth discovery and channel
+    setup happen only on first use) and shared by all threads; the underlying
+    requests session and gRPC/HTTP channels are thread-safe and pool their
+    connections. After a fork the child builds its own clients. Backends can be
+    swapped with use(), e.g. for local stubs in tests and benchmarks.
+    """
+
+    DEFAULT_FACTORIES = {"http": _http_session, "tts": _tts_client, "tts_short": _tts_short_client, "storage": _storage_client}
+    DEFAULT_HEALTH_CHECKS = {_http_session: _check_http}
+
+    def __init__(self, **factories):
+        self._factories = {**self.DEFAULT_FACTORIES, **factories}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, name):
+        """Get (creating on first use) the client registered under name."""
+        if os.getpid() != self._pid:
+            # Never share channels with the parent process
+            self._lock = threading.Lock()
+            self._clients = {}
+            self._pid = os.getpid()
+
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._factories[name]()
+                    self._clients[name] = client
+        return client
+
+    @property
+    def http(self) -> requests.Session:
+        return self.get("http")
+
+    @property
+    def tts(self):
+        return self.get("tts")
+
+    @property
+    def tts_short(self):
+        return self.get("tts_short")
+
+    @property
+    def storage(self):
+        return self.get("storage")
+
+    def use(self, **factories):
+        """Replace client factories (e.g. with stub backends); affected clients are rebuilt on next use."""
+        with self._lock:
+            for name, factory in factories.items():
+                self._factories[name] = factory or self.DEFAULT_FACTORIES[name]
+                self._clients.pop(name, None)
+
+    def reset(self):
+        """Drop all clients; they are rebuilt on next use."""
+        with self._lock:
+            for client in self._clients.values():
+                close = getattr(client, "close", None)
+                if callable(close):
+                    try:
+                        close()
+                    except Exception as e:
+                        logging.warning(f">>> closing client failed: {e}")
+            self._clients = {}
+
+    def warm_up(self, *names):
+        """Create clients up front so connection setup is not paid by the first story."""
+        for name in names or self._factories:
+            self.get(name)
+
+    def health(self, *names):
+        """
+        Check that clients can be created and, where cheap, reached.
+
+        The LLM gateway is probed on its liveliness endpoint; stub clients can
+        provide a health_check() method.
+
+        Returns:
+            dict: name -> {"ok": bool, "error": str or None}
+        """
+        report = {}
+        for name in names or self._factories:
+            try:
+                client = self.get(name)
+                check = self.DEFAULT_HEALTH_CHECKS.get(self._factories[name])
+                if check is not None:
+                    check(client)
+                elif callable(getattr(client, "health_check", None)):
+                    client.health_check()
+                report[name] = {"ok": True, "error": None}
+            except Exception as e:
+                report[name] = {"ok": False, "error": str(e)}
+        return report
+
+
+# Singleton instance
+clients = ClientProvider()
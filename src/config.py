@@ -4,13 +4,30 @@ import os
 # Base paths
 BASE_DIR = Path(__file__).parent.parent
 SRC_DIR = BASE_DIR / "src"
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))  # overridable, e.g. to run against a synthetic library
 
 # Ensure data directory exists
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # Database
 DATABASE_PATH = DATA_DIR / "database.db"
+DATABASE_BUSY_TIMEOUT_MS = 5000  # wait this long for a lock held by another worker
+DATABASE_MMAP_SIZE = 256 * 1024 * 1024
+DATABASE_CACHED_STATEMENTS = 256  # prepared statements kept per connection
+DATABASE_ASYNC_WORKERS = 2  # dedicated threads serving awaitable queries
+
+# Playtime Storage
+PLAYTIME_RAW_RETENTION_MONTHS = 13  # months of raw events kept besides the current one; older ones live on in the daily rollup
+PLAYTIME_HOURLY_RETENTION_DAYS = 90  # hourly buckets kept (only the 24h stats read them)
+PLAYTIME_RETENTION_INTERVAL = 6 * 3600  # seconds between retention runs of the leading worker
+
+# Playtime Ingestion
+PLAYTIME_BATCH_SIZE = 200  # flush after this many buffered events
+PLAYTIME_FLUSH_INTERVAL_MS = 1000  # ... or after this long, whichever comes first
+PLAYTIME_QUEUE_SIZE = 10000  # maximum buffered events
+PLAYTIME_QUEUE_POLICY = "reject"  # when full: "reject" new events (HTTP 503) or "drop_oldest"
+PLAYTIME_WRITE_RETRIES = 4  # retries of a failed batch (e.g. "database is locked") before it is dropped
+PLAYTIME_RETRY_DELAY_MS = 100  # wait before the first retry, doubled for each further one
 
 # Google Cloud
 GOOGLE_BUCKET = "gs://zalazium/"
@@ -22,6 +39,11 @@ TTS_VOICE_LANGUAGE = "de-DE"
 TTS_VOICE_NAME = "de-DE-Chirp3-HD-Leda"
 TTS_RATE_LIMIT = 90
 TTS_TIME_WINDOW = 60
+RATE_LIMIT_DB_PATH = DATA_DIR / "ratelimit.db"  # token buckets shared by all generation processes
+TTS_STREAM_CHUNK_SIZE = 1024 * 1024  # bytes piped from the bucket into ffmpeg at a time
+TTS_MODE = os.getenv("TTS_MODE", "long")  # "long": one long-audio job per story, "chunked": parallel per-chunk synthesis
+TTS_CHUNK_MAX_BYTES = 4500  # synthesize_speech accepts at most 5000 bytes of input
+TTS_CHUNK_CONCURRENCY = 8  # chunks of one story synthesized at once (still bound by the rate limit)
 
 # API Configuration
 LITELLM_MASTER_KEY = os.getenv("LITELLM_MASTER_KEY")
@@ -31,10 +53,81 @@ DOMAIN_WRAPPER = os.getenv("DOMAIN_WRAPPER", "http://localhost:8080")
 STATIC_DIR = SRC_DIR / "static"
 TEMPLATES_DIR = SRC_DIR / "templates"
 
+# Audio Streaming
+AUDIO_MAX_RANGES = 16  # more ranges than this are ignored and the full file is sent
+
+# Pages and Static Assets
+ASSET_CHECK_INTERVAL = 2  # seconds between source file change checks of a cached page or asset
+ASSET_COMPRESS_MIN_SIZE = 512  # smaller bodies are only sent uncompressed
+STATIC_MAX_AGE = 365 * 24 * 3600  # for versioned asset URLs (?v=...)
+
+# Audio Variants (bitrate ladder, stored as <theme>/.variants/<name>/<title>.<ext>)
+AUDIO_VARIANTS = {
+    "mp3-64": {"ext": "mp3", "media_type": "audio/mpeg", "ffmpeg_args": ["-ac", "1", "-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"]},
+    "mp3-32": {"ext": "mp3", "media_type": "audio/mpeg", "ffmpeg_args": ["-ac", "1", "-ar", "22050", "-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3"]},
+    # Not every browser plays Opus, so it is only picked automatically if the Accept header names audio/ogg
+    "opus-24": {"ext": "ogg", "media_type": "audio/ogg", "ffmpeg_args": ["-ac", "1", "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"], "needs_accept": True},
+}
+AUDIO_SAVE_DATA_VARIANTS = ["opus-24", "mp3-32"]  # tried in order for clients sending "Save-Data: on"
+
+# Hot-File Cache (memory-mapped most played audio, per worker)
+HOT_CACHE_ENABLED = os.getenv("HOT_CACHE_ENABLED", "true").lower() == "true"
+HOT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+HOT_CACHE_ADMIT_AFTER = 3  # requests to a file before it may be mapped
+HOT_CACHE_DECAY_EVERY = 10000  # halve all access counts after this many requests, so old favourites fade
+HOT_CACHE_CHECK_INTERVAL = 1  # seconds a mapped file is served without checking whether it was replaced
+HOT_CACHE_SEED_TOP = 50  # most played stories of the last 30 days mapped at startup
+
+# HLS (segmented delivery, stored as <theme>/.hls/<title>/index.m3u8 plus segments)
+HLS_ENABLED = os.getenv("HLS_ENABLED", "true").lower() == "true"
+HLS_SEGMENT_SECONDS = 10
+HLS_FFMPEG_ARGS = ["-ac", "1", "-c:a", "aac", "-b:a", "64k"]
+HLS_PLAYLIST_MAX_AGE = 300  # playlist URLs are stable, so they are revalidated
+HLS_SEGMENT_MAX_AGE = 365 * 24 * 3600  # segment names carry the source version, so they never change
+
+# Catalog
+CATALOG_REFRESH_INTERVAL = 5  # seconds between directory mtime checks
+
+# Multi-Worker Coordination (one elected worker writes playtime and scans the library)
+COORDINATION_DIR = DATA_DIR / ".coordination"
+COORDINATION_LOCK_PATH = COORDINATION_DIR / "leader.lock"  # flock held by the leader for its lifetime
+COORDINATION_SOCKET_PATH = COORDINATION_DIR / "ingest.sock"  # followers forward playtime batches here
+SHARED_CATALOG_PATH = COORDINATION_DIR / "catalog.json"  # catalog snapshot published by the leader
+COORDINATION_ELECTION_INTERVAL = 2  # seconds between leadership attempts of followers
+COORDINATION_FORWARD_TIMEOUT = 2  # seconds a forwarded batch may take before it is written directly
+
+# Audio Metadata Index
+METADATA_DATABASE_PATH = DATA_DIR / "metadata.db"
+METADATA_SCAN_WORKERS = min(16, (os.cpu_count() or 2) * 2)  # files parsed and hashed at once
+
+# Icons
+ICON_SIZES = [16, 32, 48, 64, 128, 192, 256, 512]
+FAVICON_SIZES = [16, 32, 48]
+ICON_CACHE_DIR = DATA_DIR / ".cache" / "icons"  # rendered icons, keyed by a hash of logo.png
+ICON_CACHE_MAX_AGE = 30 * 24 * 3600
+
+# Content Cache (LLM and TTS outputs)
+CONTENT_CACHE_DIR = DATA_DIR / ".cache" / "content"
+CONTENT_CACHE_MAX_BYTES = 5 * 1024**3  # least recently used entries are evicted beyond this
+
 # Story Generation
 DEFAULT_TARGET_GROUP = "Kinder von 6 Jahren bis 14 Jahren"
 DEFAULT_WORD_LIMIT = 2000
 DEFAULT_MODEL = "gemini-2.5-flash"
 
+# Generation Pipeline (concurrency per stage)
+PIPELINE_LLM_CONCURRENCY = 8
+PIPELINE_TTS_SUBMIT_CONCURRENCY = 4
+PIPELINE_TTS_INFLIGHT = 30  # long-audio operations being polled at once
+PIPELINE_TRANSCODE_CONCURRENCY = max(1, (os.cpu_count() or 2) - 1)  # concurrent download -> ffmpeg streams
+PIPELINE_POLL_INTERVAL = 10  # seconds between long-audio operation polls
+PIPELINE_TTS_TIMEOUT = 600
+
+# Job Queue
+JOBS_DATABASE_PATH = DATA_DIR / "jobs.db"
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 60  # seconds before the first retry, doubled on every further attempt
+JOB_CONCURRENCY = 40  # jobs in progress at once
+
 # Themes
 AVAILABLE_THEMES = ["Dinosaurier", "Drachen", "Einhörner", "Piraten", "Detektive", "Weltraum", "Monster", "Ritter", "Hexen", "Elfen", "Grusel", "Weihnachten"]
@@ -0,0 +1,153 @@
+from config import CONTENT_CACHE_DIR, CONTENT_CACHE_MAX_BYTES
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import shutil
+import json
+import os
+
+
+class ContentCache:
+    """
+    Persistent content-addressed store for generation outputs.
+
+    Entries live under ``root/<namespace>/<key[:2]>/<key>`` where the key is a
+    hash of everything that determines the output (e.g. model + prompt, or
+    voice + text). Reads refresh the entry's mtime, and once the store grows
+    beyond ``max_bytes`` the least recently used entries are evicted. Files
+    have no extension so catalog and library scans never pick them up.
+    """
+
+    def __init__(self, root=CONTENT_CACHE_DIR, max_bytes=CONTENT_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def key(*parts):
+        """Hash the parts that identify an output into a cache key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, namespace, key):
+        return self.root / namespace / key[:2] / key
+
+    def _hit(self, path):
+        try:
+            os.utime(path)
+            self._stats["hits"] += 1
+            return True
+        except FileNotFoundError:
+            self._stats["misses"] += 1
+            return False
+
+    def get(self, namespace, key):
+        """Get cached bytes or None."""
+        path = self.path(namespace, key)
+        if not self._hit(path):
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get_json(self, namespace, key):
+        data = self.get(namespace, key)
+        return None if data is None else json.loads(data)
+
+    def get_file(self, namespace, key, dest_path):
+        """Copy a cached entry to dest_path (atomically); returns False on a miss."""
+        path = self.path(namespace, key)
+        if not self._hit(path):
+            return False
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        try:
+            shutil.copyfile(path, tmp_path)
+        except FileNotFoundError:
+            return False
+        os.replace(tmp_path, dest_path)
+        return True
+
+    def _store(self, namespace, key, write):
+        path = self.path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        write(tmp_path)
+        size = tmp_path.stat().st_size
+        with self._lock:
+            # An existing entry is replaced, so only the difference counts
+            try:
+                size -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._stats["writes"] += 1
+            if self._size is not None:
+                self._size += size
+        self.evict()
+
+    def put(self, namespace, key, data):
+        self._store(namespace, key, lambda tmp_path: tmp_path.write_bytes(data))
+
+    def put_json(self, namespace, key, value):
+        self.put(namespace, key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def put_file(self, namespace, key, src_path):
+        """Store a copy of src_path without reading it into memory."""
+        self._store(namespace, key, lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+
+    def discard(self, namespace, key):
+        path = self.path(namespace, key)
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            if self._size is not None:
+                self._size -= size
+
+    def _entries(self):
+        for path in self.root.glob("*/*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Delete least recently used entries until the store is below 90% of max_bytes."""
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+            entries = sorted(self._entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            target = self.max_bytes * 0.9 if size > self.max_bytes else size
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                try:
+                    path.unlink()
+                    size -= entry_size
+                    self._stats["evictions"] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f">>> could not evict {path}: {e}")
+            self._size = size
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self._size, "max_bytes": self.max_bytes, **self._stats}
+
+
+# Singleton instance
+content_cache = ContentCache()
@@ -0,0 +1,314 @@
+"""
+Leader election and single-writer coordination between the worker processes of the FastAPI application.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from config import (
+    COORDINATION_LOCK_PATH,
+    COORDINATION_SOCKET_PATH,
+    SHARED_CATALOG_PATH,
+    COORDINATION_ELECTION_INTERVAL,
+    COORDINATION_FORWARD_TIMEOUT,
+    PLAYTIME_RETENTION_INTERVAL,
+)
+from catalog_service import CatalogService, catalog_service
+from ingest_service import PlaytimeIngestService, ingest_service
+from db_service import DatabaseService, db_service
+
+
+class _NotDelivered(Exception):
+    """The batch never reached the leader, so writing it directly cannot duplicate it."""
+
+
+class _ForwardHandler(socketserver.StreamRequestHandler):
+    """One follower connection: newline-delimited {"id", "events"} batches in, {"rejected": n} acknowledgements out."""
+
+    def handle(self):
+        coordination = self.server.coordination
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                rejected = coordination.receive(message["id"], message["events"])
+            except (ValueError, TypeError, KeyError) as e:
+                logging.error(f">>> invalid playtime batch from a follower: {e}")
+                rejected = 0
+            try:
+                self.wfile.write(json.dumps({"rejected": rejected}).encode() + b"\n")
+            except OSError:
+                # The follower gave up waiting; it resends the batch under the same id
+                return
+
+
+class _ForwardServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class CoordinationService:
+    """
+    Elects one worker as the writer and routes shared work to it.
+
+    The worker that holds an exclusive flock on the lock file is the leader.
+    The kernel releases the lock when the process dies, and followers retry
+    every ``election_interval`` seconds, so leadership moves on without
+    leases or heartbeats. The leader writes all playtime events to SQLite, including
+    batches that followers forward over a Unix socket, and it is the only
+    process that scans the library and publishes the catalog to a shared file,
+    and it applies the playtime retention every ``retention_interval`` seconds.
+    Followers buffer and batch playtime events as before but hand the batches
+    to the leader; if it cannot be reached they write them directly, so no
+    event is lost while leadership changes. Every batch carries an id and the
+    leader remembers the answers to the last ``BATCH_MEMORY`` ids, so a batch
+    whose acknowledgement got lost is resent instead of being written twice.
+    """
+
+    BATCH_MEMORY = 4096
+    FORWARD_ATTEMPTS = 3
+
+    def __init__(
+        self,
+        ingest: PlaytimeIngestService = ingest_service,
+        catalog: CatalogService = catalog_service,
+        db: DatabaseService = db_service,
+        lock_path: Path = COORDINATION_LOCK_PATH,
+        socket_path: Path = COORDINATION_SOCKET_PATH,
+        catalog_path: Path = SHARED_CATALOG_PATH,
+        election_interval: float = COORDINATION_ELECTION_INTERVAL,
+        forward_timeout: float = COORDINATION_FORWARD_TIMEOUT,
+        retention_interval: float = PLAYTIME_RETENTION_INTERVAL,
+    ):
+        self.ingest = ingest
+        self.catalog = catalog
+        self.db = db
+        self.lock_path = Path(lock_path)
+        self.socket_path = Path(socket_path)
+        self.catalog_path = Path(catalog_path)
+        self.election_interval = election_interval
+        self.forward_timeout = forward_timeout
+        self.retention_interval = retention_interval
+        self.is_leader = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[_ForwardServer] = None
+        self._conn: Optional[socket.socket] = None
+        self._reader = None
+        self._conn_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._batches: OrderedDict[str, dict] = OrderedDict()
+        self._batches_lock = threading.Lock()
+        self._stats = {"elections_won": 0, "forwarded": 0, "written_directly": 0, "forward_failures": 0, "unconfirmed": 0, "direct_write_failures": 0}
+
+    def _try_lead(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        return True
+
+    def _serve(self):
+        # Only the lock holder gets here, so a leftover socket belongs to a dead leader
+        self.socket_path.unlink(missing_ok=True)
+        try:
+            server = _ForwardServer(str(self.socket_path), _ForwardHandler)
+        except OSError as e:
+            # Followers then write their batches directly
+            logging.error(f">>> could not listen on {self.socket_path}: {e}")
+            return
+        server.coordination = self
+        self._server = server
+        threading.Thread(target=server.serve_forever, name="playtime-forward-server", daemon=True).start()
+
+    def _become_leader(self):
+        self.is_leader = True
+        self._stats["elections_won"] += 1
+        self.ingest.sink = None
+        self.catalog.lead(self.catalog_path)
+        self._serve()
+        self._disconnect()
+        logging.info(f">>> worker {os.getpid()} is the leader")
+
+    def _apply_retention(self):
+        try:
+            result = self.db.apply_retention()
+            if result["dropped_partitions"] or result["hourly_rows"]:
+                logging.info(f">>> playtime retention dropped {len(result['dropped_partitions'])} partitions and {result['hourly_rows']} hourly rows")
+        except Exception as e:
+            logging.error(f">>> playtime retention failed: {e}")
+
+    def _elect(self):
+        next_retention = 0.0
+        while not self._stop.wait(self.election_interval):
+            if not self.is_leader and self._try_lead():
+                self._become_leader()
+            if self.is_leader and time.monotonic() >= next_retention:
+                next_retention = time.monotonic() + self.retention_interval
+                self._apply_retention()
+
+    def start(self):
+        """Take part in the election; followers keep trying in the background until they lead or stop()."""
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        if self._try_lead():
+            self._become_leader()
+        else:
+            self.ingest.sink = self.forward
+            self.catalog.follow(self.catalog_path)
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._elect, name="leader-election", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Leave the election; a leader closes its socket and releases the lock so a follower takes over."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.election_interval + 1)
+            self._thread = None
+        self.ingest.sink = None
+        self._disconnect()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self.socket_path.unlink(missing_ok=True)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_leader = False
+
+    def _disconnect(self):
+        with self._conn_lock:
+            self._disconnect_locked()
+
+    def _disconnect_locked(self):
+        if self._conn is not None:
+            self._reader.close()
+            self._conn.close()
+            self._conn, self._reader = None, None
+
+    def receive(self, batch_id: str, events: list) -> int:
+        """
+        Queue a batch forwarded by a follower, once per batch id.
+
+        Returns:
+            int: Number of trailing events that were not queued
+        """
+        with self._batches_lock:
+            entry = self._batches.get(batch_id)
+            first = entry is None
+            if first:
+                entry = self._batches[batch_id] = {"done": threading.Event(), "rejected": len(events)}
+                while len(self._batches) > self.BATCH_MEMORY:
+                    self._batches.popitem(last=False)
+        if not first:
+            # A resend: answer like the first delivery, which may still be queuing
+            entry["done"].wait()
+            return entry["rejected"]
+        try:
+            entry["rejected"] = len(events) - self.ingest.submit_events(events, timeout=self.forward_timeout / 2)
+        finally:
+            entry["done"].set()
+        return entry["rejected"]
+
+    def _send(self, message: bytes) -> int:
+        """
+        Send one batch over the (re)used connection.
+
+        Returns:
+            int: Number of trailing events the leader rejected
+
+        Raises:
+            _NotDelivered: If the batch could not be sent at all
+            OSError, ValueError, KeyError: If no valid acknowledgement arrived; the leader may have the batch
+        """
+        try:
+            if self._conn is None:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                conn.settimeout(self.forward_timeout)
+                try:
+                    conn.connect(str(self.socket_path))
+                except OSError:
+                    conn.close()
+                    raise
+                self._conn, self._reader = conn, conn.makefile("rb")
+            self._conn.sendall(message)
+        except OSError as e:
+            self._disconnect_locked()
+            raise _NotDelivered(e) from e
+        try:
+            line = self._reader.readline()
+            if not line:
+                raise ConnectionError("leader closed the connection")
+            return json.loads(line)["rejected"]
+        except BaseException:
+            self._disconnect_locked()
+            raise
+
+    def _write_directly(self, events: list):
+        if self.ingest.write_with_retries(self.db.track_playtime_batch, events):
+            self._stats["written_directly"] += len(events)
+        else:
+            self._stats["direct_write_failures"] += len(events)
+
+    def forward(self, events: list):
+        """
+        Ingest sink of followers: hand a batch to the leader.
+
+        Events the leader cannot take (it is unreachable, restarting or its
+        queue stays full) are written to the database by this worker instead,
+        with retries. A batch the leader may have received but did not
+        acknowledge is resent under the same id and never written directly,
+        so no event is stored twice. This method does not raise.
+
+        Args:
+            events: (theme, title, duration_seconds, timestamp) tuples
+        """
+        message = json.dumps({"id": uuid.uuid4().hex, "events": events}).encode() + b"\n"
+        rejected, sent, error = None, False, None
+        for _ in range(self.FORWARD_ATTEMPTS):
+            try:
+                with self._conn_lock:
+                    rejected = self._send(message)
+                break
+            except _NotDelivered as e:
+                self._stats["forward_failures"] += 1
+                if not sent:
+                    logging.warning(f">>> forwarding {len(events)} playtime events to the leader failed, writing them directly: {e}")
+                    rejected = len(events)
+                else:
+                    # The leader that may hold the batch is gone; a new one would not recognize the id
+                    error = e
+                break
+            except (OSError, ValueError, KeyError) as e:
+                self._stats["forward_failures"] += 1
+                sent, error = True, e
+        if rejected is None:
+            # Writing the batch here could store it twice
+            self._stats["unconfirmed"] += len(events)
+            logging.error(f">>> the leader did not confirm {len(events)} forwarded playtime events: {error}")
+            return
+        self._stats["forwarded"] += len(events) - rejected
+        if rejected:
+            self._write_directly(events[len(events) - rejected :])
+
+    def stats(self) -> dict:
+        """Role of this worker and forwarding counters."""
+        return {"pid": os.getpid(), "leader": self.is_leader, **self._stats}
+
+
+# Singleton instance
+coordination_service = CoordinationService()
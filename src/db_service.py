@@ -1,123 +1,359 @@
-from config import DATABASE_PATH, DATA_DIR
-from datetime import datetime, timedelta
+from config import (
+    DATABASE_PATH,
+    DATA_DIR,
+    DATABASE_BUSY_TIMEOUT_MS,
+    DATABASE_MMAP_SIZE,
+    DATABASE_CACHED_STATEMENTS,
+    DATABASE_ASYNC_WORKERS,
+    PLAYTIME_RAW_RETENTION_MONTHS,
+    PLAYTIME_HOURLY_RETENTION_DAYS,
+)
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from collections import defaultdict
+from functools import partial
 from pathlib import Path
+from metrics_service import metrics_service
+import threading
+import asyncio
 import sqlite3
+import os
+import re
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+HOUR_FORMAT = "%Y-%m-%d %H:00"
+DAY_FORMAT = "%Y-%m-%d"
+PARTITION_PREFIX = "playtime_events_"  # raw events live in one table per month, e.g. playtime_events_2025_01
+
+query_seconds = metrics_service.histogram("db_query_duration_seconds", "Duration of database service calls including the connection checkout", ("query",))
+
+
+class ConnectionPool:
+    """
+    Reusable per-thread SQLite connections.
+
+    Every thread gets one long-lived connection configured for concurrent use by
+    several worker processes: WAL journaling, synchronous=NORMAL, a busy timeout,
+    memory-mapped reads and a prepared-statement cache. Write transactions start
+    with BEGIN IMMEDIATE so writers queue on the busy timeout instead of failing
+    with "database is locked" when upgrading a read lock. Connections are
+    re-opened after a fork and closed once their thread has exited.
+    """
+
+    def __init__(self, db_path, busy_timeout_ms=DATABASE_BUSY_TIMEOUT_MS, mmap_size=DATABASE_MMAP_SIZE, cached_statements=DATABASE_CACHED_STATEMENTS):
+        self.db_path = str(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = {}
+        self._pid = os.getpid()
+        self._stats = {"opened": 0, "reused": 0, "closed": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level="IMMEDIATE",
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _reset_after_fork(self):
+        # Connections must not be shared with the parent process; drop them without closing
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = {}
+        self._pid = os.getpid()
+
+    def _close_dead(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            self._connections.pop(ident).close()
+            self._stats["closed"] += 1
+
+    def acquire(self):
+        """Get the calling thread's connection, opening it on first use."""
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._stats["reused"] += 1
+            return conn
+
+        conn = self._connect()
+        self._local.conn = conn
+        with self._lock:
+            self._close_dead()
+            self._connections[threading.get_ident()] = conn
+            self._stats["opened"] += 1
+        return conn
+
+    def close_all(self):
+        """Close every pooled connection (e.g. on shutdown)."""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+                self._stats["closed"] += 1
+            self._connections.clear()
+            self._local = threading.local()
+
+    def stats(self):
+        """Get pool counters and the number of open connections."""
+        with self._lock:
+            return {"open": len(self._connections), "pid": self._pid, **self._stats}
 
 
 class DatabaseService:
+    """
+    Playtime storage: raw events in monthly partitions plus hourly and daily rollups.
+
+    Events are appended to the partition of their month, a plain rowid table
+    without secondary indexes, so an insert touches one B-tree. The
+    playtime_events view is the UNION ALL of all partitions and is rebuilt
+    whenever a month is added or dropped. Stats only read the rollups, which
+    are updated in the same transaction as the events. Retention therefore
+    only has to drop whole partitions and old hourly buckets.
+    """
+
     def __init__(self, db_path=None):
         self.db_path = db_path or DATABASE_PATH
+        self.pool = ConnectionPool(self.db_path)
+        self._known_partitions = set()
         self._init_db()
 
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(str(self.db_path))
-        conn.row_factory = sqlite3.Row
+        conn = self.pool.acquire()
         try:
             yield conn
+        except BaseException:
+            conn.rollback()
+            raise
         finally:
-            conn.close()
+            # Never leave a transaction open on a connection that is reused
+            if conn.in_transaction:
+                conn.rollback()
+
+    def pool_stats(self):
+        return self.pool.stats()
 
     def _init_db(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
 
-            cursor.execute(
+            # Rollups maintained on insert so stats never scan the raw events
+            for table, key in (("playtime_hourly", "bucket"), ("playtime_daily", "day")):
+                cursor.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        {key} TEXT NOT NULL,
+                        theme TEXT NOT NULL,
+                        title TEXT NOT NULL,
+                        seconds INTEGER NOT NULL DEFAULT 0,
+                        plays INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY ({key}, theme, title)
+                    ) WITHOUT ROWID
                 """
-                CREATE TABLE IF NOT EXISTS playtime_tracking (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    theme TEXT NOT NULL,
-                    title TEXT NOT NULL,
-                    duration_seconds INTEGER NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
-            """
-            )
 
-            cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_timestamp ON playtime_tracking(timestamp)
-            """
+            conn.commit()
+
+            # Several workers start at once; the first one migrates, the others find it done
+            cursor.execute("BEGIN IMMEDIATE")
+            if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'playtime_tracking'").fetchone():
+                self._migrate_legacy(conn)
+            self._rebuild_view(conn)
+            conn.commit()
+            self._known_partitions = set(self._partitions(conn))
+
+            rollup_empty = cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM playtime_daily)").fetchone()[0]
+            raw_empty = cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM playtime_events)").fetchone()[0]
+            if rollup_empty and not raw_empty:
+                self._rebuild_rollups(conn)
+
+    @staticmethod
+    def _partition(month):
+        """Table name of the partition of a "YYYY-MM" month."""
+        if not re.fullmatch(r"\d{4}-\d{2}", month):
+            raise ValueError(f"Invalid partition month {month!r}")
+        return PARTITION_PREFIX + month.replace("-", "_")
+
+    def _partitions(self, conn):
+        """Names of all partition tables, oldest first."""
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (f"{PARTITION_PREFIX}[0-9]*",)).fetchall()
+        return [row[0] for row in rows]
+
+    def _create_partition(self, conn, table):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (theme TEXT NOT NULL, title TEXT NOT NULL, duration_seconds INTEGER NOT NULL, timestamp TEXT NOT NULL)")
+
+    def _rebuild_view(self, conn):
+        """Point the playtime_events view at the current partitions (left alone if it already does)."""
+        partitions = self._partitions(conn)
+        select = " UNION ALL ".join(f"SELECT theme, title, duration_seconds, timestamp FROM {table}" for table in partitions)
+        sql = f"CREATE VIEW playtime_events AS {select or 'SELECT NULL AS theme, NULL AS title, NULL AS duration_seconds, NULL AS timestamp WHERE 0'}"
+        current = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'playtime_events'").fetchone()
+        if current is None or current[0] != sql:
+            conn.execute("DROP VIEW IF EXISTS playtime_events")
+            conn.execute(sql)
+
+    def _migrate_legacy(self, conn):
+        """Move the events of the former single playtime_tracking table into monthly partitions (one-off)."""
+        # Events without a usable timestamp are kept, stamped with the time of the migration
+        migrated_at = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+        conn.execute("UPDATE playtime_tracking SET timestamp = ? WHERE strftime('%Y-%m', timestamp) IS NULL", (migrated_at,))
+        months = [row[0] for row in conn.execute("SELECT DISTINCT strftime('%Y-%m', timestamp) FROM playtime_tracking")]
+        for month in months:
+            table = self._partition(month)
+            self._create_partition(conn, table)
+            conn.execute(
+                f"INSERT INTO {table} (theme, title, duration_seconds, timestamp) "
+                "SELECT theme, title, duration_seconds, timestamp FROM playtime_tracking WHERE strftime('%Y-%m', timestamp) = ? ORDER BY id",
+                (month,),
             )
+        conn.execute("DROP TABLE playtime_tracking")
 
-            cursor.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_theme ON playtime_tracking(theme)
+    def _rebuild_rollups(self, conn):
+        """Recompute the hourly and daily rollups from the raw events (one-off backfill)."""
+        conn.execute("DELETE FROM playtime_hourly")
+        conn.execute("DELETE FROM playtime_daily")
+        conn.execute(
             """
+            INSERT INTO playtime_hourly (bucket, theme, title, seconds, plays)
+            SELECT strftime('%Y-%m-%d %H:00', timestamp), theme, title, SUM(duration_seconds), COUNT(*)
+            FROM playtime_events
+            GROUP BY 1, theme, title
+        """
+        )
+        conn.execute(
+            """
+            INSERT INTO playtime_daily (day, theme, title, seconds, plays)
+            SELECT DATE(timestamp), theme, title, SUM(duration_seconds), COUNT(*)
+            FROM playtime_events
+            GROUP BY 1, theme, title
+        """
+        )
+        conn.commit()
+
+    def _update_rollups(self, conn, events):
+        """Add (theme, title, duration_seconds, timestamp) events to the rollups within the caller's transaction."""
+        hourly = defaultdict(lambda: [0, 0])
+        daily = defaultdict(lambda: [0, 0])
+        for theme, title, duration_seconds, timestamp in events:
+            ts = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+            for rollup, key in ((hourly, ts.strftime(HOUR_FORMAT)), (daily, ts.strftime(DAY_FORMAT))):
+                rollup[(key, theme, title)][0] += duration_seconds
+                rollup[(key, theme, title)][1] += 1
+
+        for table, key, rollup in (("playtime_hourly", "bucket", hourly), ("playtime_daily", "day", daily)):
+            conn.executemany(
+                f"""
+                INSERT INTO {table} ({key}, theme, title, seconds, plays) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT ({key}, theme, title) DO UPDATE SET seconds = seconds + excluded.seconds, plays = plays + excluded.plays
+            """,
+                [(*group, seconds, plays) for group, (seconds, plays) in rollup.items()],
             )
 
+    def track_playtime(self, theme, title, duration_seconds):
+        timestamp = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+        self.track_playtime_batch([(theme, title, duration_seconds, timestamp)])
+
+    def track_playtime_batch(self, events):
+        """Insert many (theme, title, duration_seconds, timestamp) events into their monthly partitions and the rollups in a single transaction."""
+        by_month = defaultdict(list)
+        for event in events:
+            by_month[event[3][:7]].append(event)
+        tables = {month: self._partition(month) for month in by_month}
+        created = [table for table in tables.values() if table not in self._known_partitions]
+
+        with query_seconds.time("track_playtime_batch"), self.get_connection() as conn:
+            if created:
+                # New month: create its partition and extend the view atomically with the insert
+                conn.execute("BEGIN IMMEDIATE")
+                for table in created:
+                    self._create_partition(conn, table)
+                self._rebuild_view(conn)
+            for month, month_events in by_month.items():
+                conn.executemany(f"INSERT INTO {tables[month]} (theme, title, duration_seconds, timestamp) VALUES (?, ?, ?, ?)", month_events)
+            self._update_rollups(conn, events)
             conn.commit()
+        self._known_partitions.update(created)
 
-    def track_playtime(self, theme, title, duration_seconds):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO playtime_tracking (theme, title, duration_seconds) VALUES (?, ?, ?)", (theme, title, duration_seconds))
+    def apply_retention(self, raw_months=PLAYTIME_RAW_RETENTION_MONTHS, hourly_days=PLAYTIME_HOURLY_RETENTION_DAYS):
+        """
+        Drop raw partitions older than raw_months and hourly buckets older than hourly_days.
+
+        Every event was added to both rollups when it was written, so dropped
+        months live on in the daily rollup and all stats stay unchanged. Pages
+        freed by the drops are reused by new inserts, so the file stops growing.
+
+        Returns:
+            dict: Dropped partition tables and number of deleted hourly rows
+        """
+        now = datetime.now(timezone.utc)
+        months = now.year * 12 + now.month - 1 - max(1, raw_months)
+        cutoff = self._partition(f"{months // 12:04d}-{months % 12 + 1:02d}")
+        with query_seconds.time("retention"), self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            dropped = [table for table in self._partitions(conn) if table <= cutoff]
+            for table in dropped:
+                conn.execute(f"DROP TABLE {table}")
+            self._rebuild_view(conn)
+            hourly_rows = conn.execute("DELETE FROM playtime_hourly WHERE bucket < ?", ((now - timedelta(days=hourly_days)).strftime(HOUR_FORMAT),)).rowcount
             conn.commit()
+        self._known_partitions.difference_update(dropped)
+        return {"dropped_partitions": dropped, "hourly_rows": hourly_rows}
 
     def get_playtime_stats(self, period="alltime"):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+        """
+        Get total, chart and per-theme playtime from the rollups.
 
-            # Build date filter with proper parameterization
-            where_clause = ""
-            params = []
-
-            if period == "24h":
-                cutoff_date = datetime.now() - timedelta(days=1)
-                where_clause = "WHERE timestamp >= ?"
-                params = [cutoff_date.isoformat()]
-            elif period == "7d":
-                cutoff_date = datetime.now() - timedelta(days=7)
-                where_clause = "WHERE timestamp >= ?"
-                params = [cutoff_date.isoformat()]
-            elif period == "30d":
-                cutoff_date = datetime.now() - timedelta(days=30)
-                where_clause = "WHERE timestamp >= ?"
-                params = [cutoff_date.isoformat()]
+        24h reads the hourly rollup, everything else the daily one, so the cost
+        depends on the number of buckets and titles, not on the raw event count.
+        Cutoffs are aligned to the bucket (full hours / full UTC days).
+        """
+        now = datetime.now(timezone.utc)
+        if period == "24h":
+            table, key = "playtime_hourly", "bucket"
+            params = [(now - timedelta(days=1)).strftime(HOUR_FORMAT)]
+        else:
+            table, key = "playtime_daily", "day"
+            days = {"7d": 7, "30d": 30}.get(period)
+            params = [(now - timedelta(days=days)).strftime(DAY_FORMAT)] if days else []
+        where_clause = f"WHERE {key} >= ?" if params else ""
+
+        with query_seconds.time(f"playtime_stats_{period}"), self.get_connection() as conn:
+            cursor = conn.cursor()
 
             # Total playtime
-            query = f"SELECT COALESCE(SUM(duration_seconds), 0) as total_seconds FROM playtime_tracking {where_clause}"
-            cursor.execute(query, params)
+            cursor.execute(f"SELECT COALESCE(SUM(seconds), 0) FROM {table} {where_clause}", params)
             total_seconds = cursor.fetchone()[0]
 
             # Daily/hourly playtime for chart
-            if period == "24h":
-                query = f"""
-                    SELECT 
-                        strftime('%Y-%m-%d %H:00', timestamp) as period,
-                        SUM(duration_seconds) as seconds
-                    FROM playtime_tracking
-                    {where_clause}
-                    GROUP BY strftime('%Y-%m-%d %H', timestamp)
-                    ORDER BY period
-                """
-            else:
-                query = f"""
-                    SELECT 
-                        DATE(timestamp) as period,
-                        SUM(duration_seconds) as seconds
-                    FROM playtime_tracking
-                    {where_clause}
-                    GROUP BY DATE(timestamp)
-                    ORDER BY period
-                """
-
-            cursor.execute(query, params)
+            cursor.execute(f"SELECT {key} as period, SUM(seconds) as seconds FROM {table} {where_clause} GROUP BY {key} ORDER BY {key}", params)
             daily_data = cursor.fetchall()
 
             # Theme statistics
-            query = f"""
-                SELECT 
-                    theme,
-                    SUM(duration_seconds) as total_seconds,
-                    COUNT(*) as play_count
-                FROM playtime_tracking
+            cursor.execute(
+                f"""
+                SELECT theme, SUM(seconds) as total_seconds, SUM(plays) as play_count
+                FROM {table}
                 {where_clause}
                 GROUP BY theme
                 ORDER BY total_seconds DESC
-            """
-            cursor.execute(query, params)
+            """,
+                params,
+            )
             theme_stats = cursor.fetchall()
 
             return {
@@ -126,9 +362,70 @@ class DatabaseService:
                 "theme_stats": [{"theme": row["theme"], "seconds": row["total_seconds"], "count": row["play_count"]} for row in theme_stats],
             }
 
+    def get_top_stories(self, limit=50, days=30):
+        """
+        Get the most played stories of the last days from the daily rollup.
+
+        Returns:
+            list: (theme, title, plays) sorted by plays, most played first
+        """
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime(DAY_FORMAT)
+        with query_seconds.time("top_stories"), self.get_connection() as conn:
+            rows = conn.execute(
+                "SELECT theme, title, SUM(plays) AS plays FROM playtime_daily WHERE day >= ? GROUP BY theme, title ORDER BY plays DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [(row["theme"], row["title"], row["plays"]) for row in rows]
+
     def get_data(self):
         return [{"theme": d.name, "titel": f.stem, "path": str(f)} for d in Path(DATA_DIR).iterdir() if d.is_dir() for f in d.glob("*.mp3")]
 
 
-# Singleton instance
+class AsyncDatabaseService:
+    """
+    Awaitable variant of DatabaseService for FastAPI handlers.
+
+    Queries run on a small set of dedicated executor threads (each with its own
+    pooled connection), so a slow stats query never blocks the event loop.
+    """
+
+    def __init__(self, db, max_workers=DATABASE_ASYNC_WORKERS):
+        self.db = db
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        return self._executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def track_playtime(self, theme, title, duration_seconds):
+        return await self._run(self.db.track_playtime, theme, title, duration_seconds)
+
+    async def track_playtime_batch(self, events):
+        return await self._run(self.db.track_playtime_batch, events)
+
+    async def get_playtime_stats(self, period="alltime"):
+        return await self._run(self.db.get_playtime_stats, period)
+
+    async def get_top_stories(self, limit=50, days=30):
+        return await self._run(self.db.get_top_stories, limit, days)
+
+    async def get_data(self):
+        return await self._run(self.db.get_data)
+
+    def shutdown(self):
+        """Wait for running queries and stop the executor threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# Singleton instances
 db_service = DatabaseService()
+async_db_service = AsyncDatabaseService(db_service)
@@ -1,18 +1,25 @@
 from helper import DATA_DIR
-from llm import prompt
+from llm import prompt, forget
 from tts import speak
 import os
 
 
-def generate(model="azure-gpt-4.1", theme="Piraten", word_limit=100, target_group="Kinder von 6 Jahren bis 14 Jahren"):
-    # story
-    output = prompt(model=model, theme=theme, word_limit=word_limit, target_group=target_group)
-
-    # path
+def story_path(theme, title, ext="mp3"):
+    """Path of a story's audio file inside its theme directory (created if missing)."""
     theme_dir = os.path.join(DATA_DIR, theme)
     os.makedirs(theme_dir, exist_ok=True)
-    filepath = os.path.join(theme_dir, f"{output['title']}.wav")
+    return os.path.join(theme_dir, f"{title}.{ext}")
+
+
+def generate(model="azure-gpt-4.1", theme="Piraten", word_limit=100, target_group="Kinder von 6 Jahren bis 14 Jahren", job_key=None):
+    # story (cached per job_key until the audio exists)
+    output = prompt(model=model, theme=theme, word_limit=word_limit, target_group=target_group, job_key=job_key)
+
+    # path
+    filepath = story_path(theme, output["title"])
 
     # audio
     speak(text=output["story"], filepath=filepath)
+    if job_key:
+        forget(model, theme, word_limit, target_group, job_key)
     return output
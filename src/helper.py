@@ -1,11 +1,9 @@
 import logging
 import os
 
-
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "data"))
+DATA_DIR = os.path.abspath(os.getenv("DATA_DIR", os.path.join(BASE_DIR, "..", "data")))
 FILE_DB = os.path.join(DATA_DIR, "database.db")
-FILE_CACHE = os.path.join(DATA_DIR, "cache.json")
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
@@ -0,0 +1,255 @@
+"""
+Memory-mapped cache of the most played audio files for the FastAPI application.
+"""
+
+import logging
+import mmap
+import os
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+from config import HOT_CACHE_ENABLED, HOT_CACHE_MAX_BYTES, HOT_CACHE_ADMIT_AFTER, HOT_CACHE_DECAY_EVERY, HOT_CACHE_CHECK_INTERVAL
+
+
+class HotEntry:
+    """A mapped file, the fstat() it was mapped with and the number of responses reading it."""
+
+    __slots__ = ("buffer", "stat", "checked_at", "readers", "retired")
+
+    def __init__(self, buffer: mmap.mmap, stat: os.stat_result):
+        self.buffer = buffer
+        self.stat = stat
+        self.checked_at = time.monotonic()
+        self.readers = 0
+        self.retired = False
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """True if stat describes the mapped file as it was mapped."""
+        return os.path.samestat(self.stat, stat) and (self.stat.st_size, self.stat.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+
+class HotCacheService:
+    """
+    Frequency-admitted cache of memory-mapped audio files.
+
+    Every GET counts as an access to its file. Once a file has been requested
+    ``admit_after`` times it is mapped read-only, provided it fits the byte
+    budget by evicting only entries that were accessed less often (LFU, least
+    recently used first on ties); otherwise it is rejected. Access counts are
+    halved every ``decay_every`` requests so stories that fall out of favour
+    make room. Mapped pages live in the page cache and are shared by all
+    worker processes.
+
+    ``lookup()`` is a dictionary lookup meant for the event loop: it returns
+    entries whose file was checked less than ``check_interval`` seconds ago.
+    Everything that touches the disk (checking the file, mapping it) happens
+    in ``get()``, which callers run on a worker thread. Entries handed out are
+    counted as readers until ``release()``; an evicted or replaced entry is
+    closed once its last reader is done.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = HOT_CACHE_MAX_BYTES,
+        admit_after: int = HOT_CACHE_ADMIT_AFTER,
+        decay_every: int = HOT_CACHE_DECAY_EVERY,
+        check_interval: float = HOT_CACHE_CHECK_INTERVAL,
+        enabled: bool = HOT_CACHE_ENABLED,
+    ):
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self.decay_every = decay_every
+        self.check_interval = check_interval
+        self.enabled = enabled
+        self._entries: dict[Path, HotEntry] = {}  # insertion order = recency
+        self._frequency: Counter = Counter()
+        self._bytes = 0
+        self._accesses = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "admissions": 0, "rejections": 0, "evictions": 0, "invalidations": 0}
+
+    def _record(self, path: Path, count: int = 1):
+        self._frequency[path] += count
+        self._accesses += count
+        if self._accesses >= self.decay_every:
+            self._accesses = 0
+            self._frequency = Counter({key: value // 2 for key, value in self._frequency.items() if value > 1})
+
+    def _retire(self, path: Path):
+        """Drop an entry from the cache; its mapping is closed now or when its last reader releases it."""
+        entry = self._entries.pop(path)
+        self._bytes -= entry.size
+        entry.retired = True
+        if entry.readers == 0:
+            entry.buffer.close()
+
+    def _make_room(self, path: Path, size: int) -> bool:
+        """Evict colder entries until size bytes are free; False (and nothing evicted) if that is not possible."""
+        if size > self.max_bytes:
+            return False
+        needed = self._bytes + size - self.max_bytes
+        if needed <= 0:
+            return True
+        frequency = self._frequency[path]
+        victims = []
+        # Least frequently used first; dict order breaks ties by recency
+        for victim, entry in sorted(self._entries.items(), key=lambda item: self._frequency[item[0]]):
+            if needed <= 0:
+                break
+            if self._frequency[victim] >= frequency:
+                return False
+            victims.append(victim)
+            needed -= entry.size
+        if needed > 0:
+            return False
+        for victim in victims:
+            self._retire(victim)
+            self._stats["evictions"] += 1
+        return True
+
+    def _admit(self, path: Path, file: BinaryIO, stat: os.stat_result) -> Optional[HotEntry]:
+        """Map the opened file and insert it (outside of the lock); returns the entry with one reader, or None if rejected."""
+        if stat.st_size > self.max_bytes:
+            with self._lock:
+                self._stats["rejections"] += 1
+            return None
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logging.warning(f">>> could not map {path}: {e}")
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.matches(stat):
+                # Another request mapped the same file meanwhile
+                buffer.close()
+                entry.readers += 1
+                return entry
+            if entry is not None:
+                self._retire(path)
+                self._stats["invalidations"] += 1
+            if not self._make_room(path, stat.st_size):
+                buffer.close()
+                self._stats["rejections"] += 1
+                return None
+            entry = HotEntry(buffer, stat)
+            entry.readers = 1
+            self._entries[path] = entry
+            self._bytes += entry.size
+            self._stats["admissions"] += 1
+        if hasattr(buffer, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            buffer.madvise(mmap.MADV_WILLNEED)
+        return entry
+
+    def lookup(self, path: Path) -> Optional[HotEntry]:
+        """
+        Record an access and get the entry of a hot file without touching the disk.
+
+        Args:
+            path: Path of the requested file
+
+        Returns:
+            HotEntry (release() it when done) or None if the file is not mapped
+                or was not checked recently; call get() then
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or time.monotonic() - entry.checked_at >= self.check_interval:
+                return None
+            self._record(path)
+            # Move to the end: dict order is recency
+            self._entries[path] = self._entries.pop(path)
+            self._stats["hits"] += 1
+            entry.readers += 1
+            return entry
+
+    def get(self, path: Path, file: BinaryIO, stat: os.stat_result) -> Optional[HotEntry]:
+        """
+        Record an access and get the mapped file if it is (or just became) hot; may map it, so run it on a worker thread.
+
+        Args:
+            path: Path of the requested file
+            file: The opened file; a new entry maps exactly this file
+            stat: fstat() of the opened file
+
+        Returns:
+            HotEntry (release() it when done) or None if the file should be read from disk
+        """
+        if not self.enabled or stat.st_size == 0:
+            return None
+        with self._lock:
+            self._record(path)
+            entry = self._entries.get(path)
+            if entry is not None and entry.matches(stat):
+                entry.checked_at = time.monotonic()
+                self._entries[path] = self._entries.pop(path)
+                self._stats["hits"] += 1
+                entry.readers += 1
+                return entry
+            if entry is not None:
+                # Replaced on disk; map the new file below
+                self._retire(path)
+                self._stats["invalidations"] += 1
+            admit = self._frequency[path] >= self.admit_after
+        entry = self._admit(path, file, stat) if admit else None
+        with self._lock:
+            self._stats["hits" if entry is not None else "misses"] += 1
+        return entry
+
+    def release(self, entry: HotEntry):
+        """A response is done with an entry; closes the mapping if the entry left the cache meanwhile."""
+        with self._lock:
+            entry.readers -= 1
+            if entry.retired and entry.readers == 0:
+                entry.buffer.close()
+
+    def seed(self, paths: Iterable[tuple[Path, int]]):
+        """
+        Warm the cache with known favourites, e.g. the most played stories from the rollups.
+
+        Args:
+            paths: (path, plays) pairs, most played first
+        """
+        if not self.enabled:
+            return
+        for path, plays in paths:
+            try:
+                file = open(path, "rb")
+            except OSError:
+                continue
+            with file:
+                stat = os.fstat(file.fileno())
+                with self._lock:
+                    self._record(path, max(plays, self.admit_after))
+                    known = path in self._entries
+                if not known and stat.st_size:
+                    entry = self._admit(path, file, stat)
+                    if entry is not None:
+                        self.release(entry)
+
+    def close(self):
+        """Drop all entries, e.g. on shutdown; mappings still being read are closed when released."""
+        with self._lock:
+            for path in list(self._entries):
+                self._retire(path)
+
+    def stats(self) -> dict:
+        """Hit rate and size of this worker's cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes, enabled=self.enabled)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# Singleton instance
+hot_cache_service = HotCacheService()
@@ -0,0 +1,48 @@
+"""
+HTTP caching helpers shared by the FastAPI services.
+"""
+
+import hashlib
+from typing import Optional
+from fastapi.responses import Response
+
+
+def make_etag(*parts) -> str:
+    """
+    Build a strong ETag from arbitrary parts.
+
+    Args:
+        parts: Values that identify the representation (bytes or anything str()-able)
+
+    Returns:
+        str: Quoted ETag value
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag using weak comparison.
+
+    Args:
+        if_none_match: Raw If-None-Match header value
+        etag: Current ETag of the resource
+
+    Returns:
+        bool: True if the client already has this representation
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in if_none_match.split(","))
+
+
+def not_modified(headers: dict) -> Response:
+    """Build an empty 304 response carrying the validator headers."""
+    return Response(status_code=304, headers=headers)
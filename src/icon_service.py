@@ -1,69 +1,132 @@
 """Dynamic icon generation service."""
+
 from pathlib import Path
 from PIL import Image
+import hashlib
+import logging
+import threading
 import io
-from fastapi import Response
+import os
 from typing import Optional
+from config import STATIC_DIR, ICON_SIZES, FAVICON_SIZES, ICON_CACHE_DIR
+from http_cache import make_etag
+
 
 class IconService:
-    def __init__(self, source_path: str = "src/static/logo.png"):
-        self.source_path = Path(source_path)
+    def __init__(self, source_path: Optional[Path] = None, cache_dir: Optional[Path] = ICON_CACHE_DIR):
+        self.source_path = Path(source_path or STATIC_DIR / "logo.png")
+        self.cache_dir = Path(cache_dir) if cache_dir else None
         self._source_image: Optional[Image.Image] = None
-    
+        self._source_hash: Optional[str] = None
+        self._cache: dict[str, tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
     @property
     def source_image(self) -> Image.Image:
         """Lazy load and cache the source image."""
         if self._source_image is None:
             self._source_image = Image.open(self.source_path)
             # Convert to RGB if necessary
-            if self._source_image.mode != 'RGB':
-                self._source_image = self._source_image.convert('RGB')
+            if self._source_image.mode != "RGB":
+                self._source_image = self._source_image.convert("RGB")
         return self._source_image
-    
+
+    @property
+    def source_hash(self) -> str:
+        """Hash of the source logo, used to key the on-disk cache."""
+        if self._source_hash is None:
+            self._source_hash = hashlib.sha256(self.source_path.read_bytes()).hexdigest()[:16]
+        return self._source_hash
+
     def generate_icon(self, size: int, format: str = "PNG") -> bytes:
         """Generate icon of specified size."""
         # Create a copy and resize
         img = self.source_image.copy()
         img.thumbnail((size, size), Image.Resampling.LANCZOS)
-        
+
         # Create square canvas with transparent background for PNG
         if format.upper() == "PNG":
-            canvas = Image.new('RGBA', (size, size), (255, 255, 255, 0))
+            canvas = Image.new("RGBA", (size, size), (255, 255, 255, 0))
             # Center the image
             offset = ((size - img.width) // 2, (size - img.height) // 2)
             # Convert to RGBA for pasting
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
+            if img.mode != "RGBA":
+                img = img.convert("RGBA")
             canvas.paste(img, offset)
         else:
             canvas = img
-        
+
         # Save to bytes
         buffer = io.BytesIO()
         canvas.save(buffer, format=format)
         buffer.seek(0)
         return buffer.read()
-    
+
     def generate_favicon(self) -> bytes:
         """Generate multi-resolution ICO file."""
         # ICO can contain multiple sizes
-        sizes = [16, 32, 48]
+        sizes = FAVICON_SIZES
         images = []
-        
+
         for size in sizes:
             img = self.source_image.copy()
             img.thumbnail((size, size), Image.Resampling.LANCZOS)
             # Ensure it's exactly square
-            canvas = Image.new('RGB', (size, size), (255, 255, 255))
+            canvas = Image.new("RGB", (size, size), (255, 255, 255))
             offset = ((size - img.width) // 2, (size - img.height) // 2)
             canvas.paste(img, offset)
             images.append(canvas)
-        
+
         # Save as ICO
         buffer = io.BytesIO()
-        images[0].save(buffer, format='ICO', sizes=[(s, s) for s in sizes])
+        images[0].save(buffer, format="ICO", sizes=[(s, s) for s in sizes])
         buffer.seek(0)
         return buffer.read()
 
+    def _load_or_render(self, name: str, render) -> tuple[bytes, str]:
+        """Get encoded icon bytes and ETag from memory, then disk, rendering only on a full miss."""
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None:
+                return cached
+
+            data = None
+            cache_path = self.cache_dir / self.source_hash / name if self.cache_dir else None
+            if cache_path is not None and cache_path.exists():
+                data = cache_path.read_bytes()
+            if data is None:
+                data = render()
+                if cache_path is not None:
+                    try:
+                        cache_path.parent.mkdir(parents=True, exist_ok=True)
+                        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+                        tmp_path.write_bytes(data)
+                        os.replace(tmp_path, cache_path)
+                    except OSError as e:
+                        logging.warning(f">>> could not persist icon {name}: {e}")
+
+            cached = (data, make_etag(data))
+            self._cache[name] = cached
+            return cached
+
+    def get_icon(self, size: int) -> tuple[bytes, str]:
+        """Get the cached PNG icon of the given size and its ETag."""
+        return self._load_or_render(f"{size}.png", lambda: self.generate_icon(size, format="PNG"))
+
+    def get_favicon(self) -> tuple[bytes, str]:
+        """Get the cached multi-resolution favicon and its ETag."""
+        return self._load_or_render("favicon.ico", self.generate_favicon)
+
+    def warm(self):
+        """Render (or load) every icon variant so requests never hit PIL."""
+        for size in ICON_SIZES:
+            self.get_icon(size)
+        self.get_favicon()
+
+
 # Global instance
-icon_service = IconService()
\ No newline at end of file
+icon_service = IconService()
@@ -0,0 +1,200 @@
+"""
+Buffered playtime ingestion for the FastAPI application.
+"""
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+from config import PLAYTIME_BATCH_SIZE, PLAYTIME_FLUSH_INTERVAL_MS, PLAYTIME_QUEUE_SIZE, PLAYTIME_QUEUE_POLICY, PLAYTIME_WRITE_RETRIES, PLAYTIME_RETRY_DELAY_MS
+from db_service import DatabaseService, db_service
+
+
+class PlaytimeIngestService:
+    """
+    Accepts playtime events without blocking and writes them in batches.
+
+    Events go into a bounded in-memory queue. A background thread flushes them
+    with ``executemany`` in one transaction whenever ``batch_size`` events are
+    buffered or ``flush_interval_ms`` has passed since the first buffered event.
+    When the queue is full the configured policy applies: ``reject`` refuses the
+    new event, ``drop_oldest`` discards the oldest buffered one. Both are counted
+    in ``stats()``. Batches go to ``sink`` if one is set (e.g. forwarding to
+    the worker that owns the database writes), otherwise to the database. A
+    failed write is retried ``write_retries`` times with exponential backoff
+    before the batch is counted as failed and dropped; a sink that must not
+    see a batch twice handles its own failures and does not raise.
+    """
+
+    POLICIES = ("reject", "drop_oldest")
+
+    def __init__(
+        self,
+        db: Optional[DatabaseService] = None,
+        batch_size: int = PLAYTIME_BATCH_SIZE,
+        flush_interval_ms: int = PLAYTIME_FLUSH_INTERVAL_MS,
+        max_queue: int = PLAYTIME_QUEUE_SIZE,
+        policy: str = PLAYTIME_QUEUE_POLICY,
+        write_retries: int = PLAYTIME_WRITE_RETRIES,
+        retry_delay_ms: int = PLAYTIME_RETRY_DELAY_MS,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, must be one of {self.POLICIES}")
+        self.db = db or db_service
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.policy = policy
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay_ms / 1000
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._submit_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"accepted": 0, "rejected": 0, "dropped": 0, "received": 0, "written": 0, "failed": 0, "retries": 0, "batches": 0}
+        self.sink: Optional[Callable[[list], None]] = None
+
+    def submit(self, theme: str, title: str, duration_seconds: int) -> bool:
+        """
+        Queue one playtime event.
+
+        Args:
+            theme: Theme name
+            title: Story title
+            duration_seconds: Listened seconds
+
+        Returns:
+            bool: False if the event was rejected because the queue is full
+        """
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        event = (theme, title, duration_seconds, timestamp)
+        with self._submit_lock:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                if self.policy == "reject":
+                    self._counters["rejected"] += 1
+                    return False
+                try:
+                    self._queue.get_nowait()
+                    self._counters["dropped"] += 1
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(event)
+            self._counters["accepted"] += 1
+        if self._thread is None:
+            # No background writer (e.g. scripts): write through
+            self.flush()
+        return True
+
+    def submit_events(self, events: list, timeout: float = 0.0) -> int:
+        """
+        Queue already timestamped events, e.g. batches forwarded by other workers.
+
+        Args:
+            events: (theme, title, duration_seconds, timestamp) tuples
+            timeout: Seconds to wait for room in a full queue; the policy does not apply
+
+        Returns:
+            int: Number of leading events that were queued
+        """
+        deadline = time.monotonic() + timeout
+        accepted = 0
+        for event in events:
+            try:
+                self._queue.put(tuple(event), timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+            accepted += 1
+        with self._submit_lock:
+            self._counters["received"] += accepted
+        if self._thread is None:
+            self.flush()
+        return accepted
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write_with_retries(self, write: Callable[[list], None], batch: list) -> bool:
+        """
+        Call write(batch), retrying ``write_retries`` times with exponential backoff.
+
+        Returns:
+            bool: False if every attempt failed and the batch was dropped
+        """
+        for attempt in range(self.write_retries + 1):
+            try:
+                write(batch)
+                return True
+            except Exception as e:
+                if attempt == self.write_retries:
+                    logging.error(f">>> failed to write {len(batch)} playtime events after {attempt + 1} attempts, dropping them: {e}")
+                    return False
+                self._counters["retries"] += 1
+                logging.warning(f">>> failed to write {len(batch)} playtime events, retrying: {e}")
+                time.sleep(self.retry_delay * 2**attempt)
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        if self.write_with_retries(self.sink or self.db.track_playtime_batch, batch):
+            self._counters["written"] += len(batch)
+            self._counters["batches"] += 1
+        else:
+            self._counters["failed"] += len(batch)
+
+    def flush(self):
+        """Write everything that is currently buffered."""
+        with self._flush_lock:
+            while batch := self._drain():
+                self._write(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self._flush_lock:
+                self._write(batch)
+
+    def start(self):
+        """Start the background writer."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="playtime-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background writer and flush remaining events."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        """Get queue depth and counters for monitoring the backpressure policy."""
+        return {"queued": self._queue.qsize(), "capacity": self._queue.maxsize, "policy": self.policy, **self._counters}
+
+
+# Singleton instance
+ingest_service = PlaytimeIngestService()
@@ -0,0 +1,228 @@
+from config import JOBS_DATABASE_PATH, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY
+from collections import Counter
+import threading
+import logging
+import asyncio
+import sqlite3
+import json
+import time
+
+
+class JobQueue:
+    """
+    Durable queue of story generation jobs in SQLite.
+
+    Every job records its current stage, attempts, per-stage timings and last
+    error. Jobs that were running when the process died are put back on resume,
+    failed jobs are retried with exponential backoff up to max_attempts, and
+    fill() tops up each theme to a target number of stories. Running totals
+    per stage are kept for finished jobs so reading them does not grow with
+    the history.
+    """
+
+    def __init__(self, db_path=JOBS_DATABASE_PATH, max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY):
+        self.db_path = str(db_path)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_db()
+
+    def _init_db(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    theme TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    word_limit INTEGER NOT NULL,
+                    target_group TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    stage TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    title TEXT,
+                    error TEXT,
+                    timings TEXT NOT NULL DEFAULT '{}',
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_attempt_at)")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stage_totals (
+                    stage TEXT PRIMARY KEY,
+                    seconds REAL NOT NULL,
+                    jobs INTEGER NOT NULL
+                )
+            """
+            )
+            # Queues created before the totals existed: add up the jobs finished so far once
+            if self._conn.execute("SELECT 1 FROM stage_totals LIMIT 1").fetchone() is None:
+                self._conn.execute(
+                    """
+                    INSERT INTO stage_totals (stage, seconds, jobs)
+                    SELECT t.key, SUM(t.value), COUNT(*) FROM jobs, json_each(jobs.timings) AS t
+                    WHERE jobs.status = 'done'
+                    GROUP BY t.key
+                """
+                )
+
+    def _execute(self, query, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(query, params).fetchall()
+
+    @staticmethod
+    def job_key(job_id):
+        """Key under which a job's intermediate outputs are cached, stable across resumes."""
+        return f"job-{job_id}"
+
+    def enqueue(self, theme, count, model, word_limit, target_group):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO jobs (theme, model, word_limit, target_group, max_attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(theme, model, word_limit, target_group, self.max_attempts, now)] * count,
+            )
+        return count
+
+    def fill(self, target, existing, model, word_limit, target_group):
+        """
+        Enqueue enough jobs to bring every theme to target stories.
+
+        Args:
+            target: Wanted number of stories per theme
+            existing: dict theme -> stories already in the library
+
+        Returns:
+            dict: theme -> newly enqueued jobs
+        """
+        open_jobs = Counter({row["theme"]: row["n"] for row in self._execute("SELECT theme, COUNT(*) AS n FROM jobs WHERE status IN ('pending', 'running') GROUP BY theme")})
+        added = {}
+        for theme, count in existing.items():
+            missing = target - count - open_jobs[theme]
+            if missing > 0:
+                added[theme] = self.enqueue(theme, missing, model, word_limit, target_group)
+        return added
+
+    def recover(self):
+        """Put jobs that were running when the last process died back into the queue."""
+        return len(self._execute("UPDATE jobs SET status = 'pending', next_attempt_at = 0 WHERE status = 'running' RETURNING id"))
+
+    def claim(self, limit):
+        """Atomically mark up to limit due jobs as running and return them."""
+        now = time.time()
+        with self._lock, self._conn:
+            return [
+                dict(row)
+                for row in self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL
+                    WHERE id IN (SELECT id FROM jobs WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?)
+                    RETURNING *
+                """,
+                    (now, now, limit),
+                ).fetchall()
+            ]
+
+    def next_due(self):
+        """Seconds until the next pending job is due, or None if nothing is pending."""
+        row = self._execute("SELECT MIN(next_attempt_at) AS due FROM jobs WHERE status = 'pending'")[0]
+        return None if row["due"] is None else max(0.0, row["due"] - time.time())
+
+    def record_stage(self, job_id, stage, seconds=None):
+        """Set the job's current stage, or add the time spent in it once it finished."""
+        if seconds is None:
+            self._execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+            return
+        with self._lock, self._conn:
+            timings = json.loads(self._conn.execute("SELECT timings FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            timings[stage] = round(timings.get(stage, 0.0) + seconds, 3)
+            self._conn.execute("UPDATE jobs SET timings = ? WHERE id = ?", (json.dumps(timings), job_id))
+
+    def complete(self, job_id, title):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = 'done', stage = NULL, title = ?, finished_at = ? WHERE id = ?", (title, time.time(), job_id))
+            timings = json.loads(self._conn.execute("SELECT timings FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            self._conn.executemany(
+                "INSERT INTO stage_totals (stage, seconds, jobs) VALUES (?, ?, 1) ON CONFLICT(stage) DO UPDATE SET seconds = seconds + excluded.seconds, jobs = jobs + 1",
+                timings.items(),
+            )
+
+    def fail(self, job_id, error):
+        """Schedule a retry with exponential backoff, or give up after max_attempts."""
+        with self._lock, self._conn:
+            attempts, max_attempts = self._conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if attempts < max_attempts:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'pending', error = ?, next_attempt_at = ? WHERE id = ?",
+                    (str(error), time.time() + self.retry_delay * 2 ** (attempts - 1), job_id),
+                )
+                return True
+            self._conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?", (str(error), time.time(), job_id))
+            return False
+
+    def counts(self):
+        """Number of jobs per status."""
+        return {row["status"]: row["n"] for row in self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+    def stage_timings(self, since=None):
+        """Total seconds and number of jobs per stage for all finished jobs, or only for those finished since the given time."""
+        if since is None:
+            return {row["stage"]: {"seconds": row["seconds"], "jobs": row["jobs"]} for row in self._execute("SELECT stage, seconds, jobs FROM stage_totals")}
+        totals = {}
+        for row in self._execute("SELECT timings FROM jobs WHERE status = 'done' AND finished_at >= ?", (since,)):
+            for stage, seconds in json.loads(row["timings"]).items():
+                total = totals.setdefault(stage, {"seconds": 0.0, "jobs": 0})
+                total["seconds"] += seconds
+                total["jobs"] += 1
+        return totals
+
+
+async def drain(queue, pipeline, max_inflight, on_done=None):
+    """
+    Run queued jobs through the pipeline until nothing is pending or running.
+
+    Keeps up to max_inflight jobs in progress, claims new ones as others finish
+    and sleeps until the next retry is due. A failing job is rescheduled or
+    marked failed; it never stops the loop.
+    """
+    running = set()
+
+    def on_stage(job_key, stage, seconds):
+        if job_key and job_key.startswith("job-"):
+            queue.record_stage(int(job_key.removeprefix("job-")), stage, seconds)
+
+    pipeline.on_stage = on_stage
+
+    async def run_job(job):
+        key = queue.job_key(job["id"])
+        try:
+            output = await pipeline.generate(job["model"], job["theme"], job["word_limit"], job["target_group"], job_key=key)
+            queue.complete(job["id"], output["title"])
+            error = None
+        except Exception as e:
+            logging.error(f">>> job {job['id']} ({job['theme']}) failed on attempt {job['attempts']}: {e}")
+            queue.fail(job["id"], e)
+            error = e
+        if on_done is not None:
+            on_done(job, error)
+
+    while True:
+        for job in queue.claim(max_inflight - len(running)) if len(running) < max_inflight else []:
+            running.add(asyncio.create_task(run_job(job)))
+        if not running:
+            due = queue.next_due()
+            if due is None:
+                return
+            await asyncio.sleep(min(due, 60))
+            continue
+        _, running = await asyncio.wait(running, timeout=60, return_when=asyncio.FIRST_COMPLETED)
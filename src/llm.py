@@ -1,17 +1,38 @@
 from prompts import prompt_builder_sys
-import requests
+from content_cache import content_cache
+from clients import clients
 import logging
+import json
 import ast
 import os
 
+STORY_FORMAT = {"story": "Hier kommt der Text der Geschichte hin.", "title": "Erzeuge ein Titel für die Geschichte mit maximal 10 Wörten"}
 
-def prompt(model="zalazium-fast", theme="Piraten", word_limit=200, target_group="Kinder von 6 Jahren bis 14 Jahren"):
-    response_format = {"story": "Hier kommt der Text der Geschichte hin.", "title": "Erzeuge ein Titel für die Geschichte mit maximal 10 Wörten"}
+
+def prompt_cache_key(model, theme, word_limit, target_group, job_key):
+    """Cache key of a story: (model, prompt hash) plus the job it belongs to, so every job still gets its own story."""
     prompt_sys = prompt_builder_sys(theme=theme, word_limit=word_limit, target_group=target_group)
-    output = _prompt(model=model, prompt_sys=prompt_sys, prompt_usr=None, response_format=response_format)
+    return content_cache.key(model, prompt_sys, json.dumps(STORY_FORMAT, sort_keys=True), job_key)
+
+
+def prompt(model="zalazium-fast", theme="Piraten", word_limit=200, target_group="Kinder von 6 Jahren bis 14 Jahren", job_key=None):
+    # a job that crashed after this stage resumes with the story it already paid for
+    key = prompt_cache_key(model, theme, word_limit, target_group, job_key) if job_key else None
+    if key and (cached := content_cache.get_json("llm", key)):
+        return cached
+
+    prompt_sys = prompt_builder_sys(theme=theme, word_limit=word_limit, target_group=target_group)
+    output = _prompt(model=model, prompt_sys=prompt_sys, prompt_usr=None, response_format=STORY_FORMAT)
+    if key and output and "no_data" not in output.values():
+        content_cache.put_json("llm", key, output)
     return output
 
 
+def forget(model, theme, word_limit, target_group, job_key):
+    """Drop a job's cached story once its audio exists, so the next run of the same job writes a new story."""
+    content_cache.discard("llm", prompt_cache_key(model, theme, word_limit, target_group, job_key))
+
+
 def _prompt(model="zalazium-fast", prompt_sys=None, prompt_usr=None, response_format={}):
     try:
         # connection
@@ -30,7 +51,7 @@ def _prompt(model="zalazium-fast", prompt_sys=None, prompt_usr=None, response_fo
         if response_format:
             data["response_format"] = _response_format(response_format)
 
-        response = requests.post(url, headers=headers, json=data, timeout=600)
+        response = clients.http.post(url, headers=headers, json=data, timeout=600)
         response.raise_for_status()
         output = _sanitize(response=response, response_format=response_format)
         return output
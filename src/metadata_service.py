@@ -0,0 +1,176 @@
+"""
+Audio metadata index shared by the server and the generation scripts.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+from mutagen.mp3 import MP3
+from config import DATA_DIR, METADATA_DATABASE_PATH, METADATA_SCAN_WORKERS
+
+
+class AudioMetadata(NamedTuple):
+    """Indexed properties of one audio file; duration and bitrate are None if the file could not be parsed."""
+
+    path: str
+    theme: str
+    title: str
+    duration: Optional[float]
+    bitrate: Optional[int]
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class MetadataService:
+    """
+    Persistent index of duration, bitrate, size, mtime and content hash per audio file.
+
+    Files are identified by path and only re-read when their size or mtime
+    changed, so a scan of an unchanged library costs one stat() per file.
+    Changed files are parsed and hashed in parallel on a thread pool (mutagen
+    only reads the headers and hashing releases the GIL). Callers that only
+    need durations can skip the hash; such entries keep an empty sha256 until
+    a hashing update reads them again. The index lives in its own SQLite file
+    so every process can read it.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, data_dir: Optional[Path] = None, workers: int = METADATA_SCAN_WORKERS):
+        self.db_path = str(db_path or METADATA_DATABASE_PATH)
+        self.data_dir = Path(data_dir or DATA_DIR)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS audio_files (
+                        path TEXT PRIMARY KEY,
+                        theme TEXT NOT NULL,
+                        title TEXT NOT NULL,
+                        duration REAL,
+                        bitrate INTEGER,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        sha256 TEXT NOT NULL
+                    )
+                """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_audio_files_theme ON audio_files(theme)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _query(self, query: str, params=()) -> list[AudioMetadata]:
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        return [AudioMetadata(*row) for row in rows]
+
+    @staticmethod
+    def _read(path: Path, size: int, mtime_ns: int, content_hash: bool = True) -> AudioMetadata:
+        """Parse the headers and, unless content_hash is False, hash the content of one file."""
+        digest = hashlib.sha256()
+        if content_hash:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+        try:
+            info = MP3(path).info
+            duration, bitrate = info.length, info.bitrate
+        except Exception as e:
+            logging.warning(f">>> could not read audio metadata of {path}: {e}")
+            duration, bitrate = None, None
+        return AudioMetadata(str(path), path.parent.name, path.stem, duration, bitrate, size, mtime_ns, digest.hexdigest() if content_hash else "")
+
+    def library_files(self) -> list[Path]:
+        """All stories of the library: top-level mp3 files of every theme directory (dot-directories are skipped)."""
+        return sorted(f for d in self.data_dir.iterdir() if d.is_dir() and not d.name.startswith(".") for f in d.glob("*.mp3"))
+
+    def update(self, files: Iterable[Path], content_hash: bool = True) -> dict[str, AudioMetadata]:
+        """
+        Bring the index entries of the given files up to date.
+
+        Args:
+            files: Audio files to look up; only new or changed ones are read
+            content_hash: Hash new or changed files (and entries indexed without a hash)
+
+        Returns:
+            dict: path -> metadata for every file that still exists
+        """
+        stats = {}
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[str(path)] = (Path(path), stat.st_size, stat.st_mtime_ns)
+
+        known = {}
+        paths = list(stats)
+        for i in range(0, len(paths), 500):
+            batch = paths[i : i + 500]
+            for entry in self._query(f"SELECT * FROM audio_files WHERE path IN ({','.join('?' * len(batch))})", batch):
+                known[entry.path] = entry
+
+        stale = [stats[key] for key in stats if key not in known or (known[key].size, known[key].mtime_ns) != stats[key][1:] or (content_hash and not known[key].sha256)]
+        if stale:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(stale))) as pool:
+                fresh = list(pool.map(lambda args: self._read(*args, content_hash), stale))
+            with self._lock, self._connection() as conn:
+                conn.executemany("INSERT OR REPLACE INTO audio_files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", fresh)
+            known.update((entry.path, entry) for entry in fresh)
+
+        return {key: known[key] for key in stats}
+
+    def scan(self) -> dict[str, int]:
+        """
+        Synchronize the index with the whole library.
+
+        Returns:
+            dict: Number of files in the library, (re)read and removed from the index
+        """
+        files = self.library_files()
+        before = {entry.path: entry.mtime_ns for entry in self._query("SELECT * FROM audio_files")}
+        current = self.update(files)
+        removed = [path for path in before if path not in current]
+        self.remove(removed)
+        read = sum(1 for path, entry in current.items() if before.get(path) != entry.mtime_ns)
+        return {"files": len(current), "read": read, "removed": len(removed)}
+
+    def remove(self, paths: Iterable[str]):
+        """Drop index entries, e.g. of deleted files."""
+        with self._lock, self._connection() as conn:
+            conn.executemany("DELETE FROM audio_files WHERE path = ?", [(str(path),) for path in paths])
+
+    def files(self, theme: Optional[str] = None) -> list[AudioMetadata]:
+        """Indexed files, optionally of one theme, sorted by path."""
+        if theme is None:
+            return self._query("SELECT * FROM audio_files ORDER BY path")
+        return self._query("SELECT * FROM audio_files WHERE theme = ? ORDER BY path", (theme,))
+
+    def theme_stats(self) -> dict[str, dict]:
+        """
+        Number of stories and total duration per theme.
+
+        Returns:
+            dict: theme -> {"count": int, "duration": float seconds}
+        """
+        with self._lock:
+            rows = self._connection().execute("SELECT theme, COUNT(*), COALESCE(SUM(duration), 0) FROM audio_files GROUP BY theme ORDER BY theme").fetchall()
+        return {theme: {"count": count, "duration": duration} for theme, count, duration in rows}
+
+
+# Singleton instance
+metadata_service = MetadataService()
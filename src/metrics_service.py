@@ -0,0 +1,237 @@
+"""
+Metrics registry, request instrumentation and Prometheus export for the FastAPI application.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, labels: tuple) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class of a labelled metric; values are kept per tuple of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Per bucket counts (non-cumulative, last one is +Inf), then sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the with-block."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - t0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels((*self.labelnames, 'le'), (*labels, bound))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+def snapshot(metric_class: type, name: str, help: str, samples: dict, labelnames: Iterable[str] = ()) -> Metric:
+    """Build a metric from values read elsewhere, e.g. by a collector; samples maps label tuples to values."""
+    metric = metric_class(name, help, labelnames)
+    metric._values = dict(samples)
+    return metric
+
+
+class MetricsService:
+    """
+    Process-wide registry of counters, gauges and histograms.
+
+    Hot paths only update in-memory values under a per-metric lock. Values
+    owned by other services (queue depths, cache counters, job timings) are
+    read by collectors at scrape time instead of being pushed on every event.
+    Each worker process has its own registry; Prometheus aggregates them.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], Iterable[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """Register a callable that builds metrics from another service's state at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                logging.error(f">>> metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, status, bytes and in-flight responses per route.
+
+    Routes are labelled by their path template (e.g. ``/api/audio/{theme}/{title}``)
+    so the number of series stays bounded. The request duration covers the
+    whole response body, so for audio it measures the stream; time to the
+    first byte is recorded separately.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: Optional[MetricsService] = None):
+        self.app = app
+        metrics = metrics or metrics_service
+        self.duration = metrics.histogram("http_request_duration_seconds", "Time until the response body was sent", ("method", "route", "status"))
+        self.first_byte = metrics.histogram("http_response_first_byte_seconds", "Time until the response headers were sent", ("method", "route"))
+        self.bytes_sent = metrics.counter("http_response_bytes_total", "Response body bytes sent", ("route",))
+        self.in_flight = metrics.gauge("http_requests_in_flight", "Requests being handled", ())
+        self.streaming = metrics.gauge("http_responses_streaming", "Responses whose body is being sent", ("route",))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        state = {"status": 500, "bytes": 0, "content_length": 0, "route": None, "started": False, "done": False}
+
+        def route() -> str:
+            if state["route"] is None:
+                matched = scope.get("route")
+                state["route"] = getattr(matched, "path", None) or "unmatched"
+            return state["route"]
+
+        def finish():
+            if state["started"] and not state["done"]:
+                state["done"] = True
+                self.streaming.dec(route())
+                self.bytes_sent.inc(route(), amount=state["bytes"])
+
+        async def send_wrapper(message: Message):
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                state["status"] = message["status"]
+                for key, value in message.get("headers", ()):
+                    if key == b"content-length":
+                        state["content_length"] = int(value)
+                self.first_byte.observe(scope["method"], route(), value=time.perf_counter() - t0)
+                self.streaming.inc(route())
+                state["started"] = True
+            elif message_type == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finish()
+            elif message_type == "http.response.zerocopysend":
+                state["bytes"] += message.get("count") or 0
+                if not message.get("more_body", False):
+                    finish()
+            elif message_type == "http.response.pathsend":
+                state["bytes"] += state["content_length"]
+                finish()
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            # Responses cut off by a client disconnect or an error still count
+            finish()
+            self.duration.observe(scope["method"], route(), f"{state['status'] // 100}xx", value=time.perf_counter() - t0)
+
+
+# Singleton instance
+metrics_service = MetricsService()
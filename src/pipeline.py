@@ -0,0 +1,136 @@
+from config import (
+    PIPELINE_LLM_CONCURRENCY,
+    PIPELINE_TTS_SUBMIT_CONCURRENCY,
+    PIPELINE_TTS_INFLIGHT,
+    PIPELINE_TRANSCODE_CONCURRENCY,
+    PIPELINE_POLL_INTERVAL,
+    PIPELINE_TTS_TIMEOUT,
+)
+from generator import story_path
+from llm import prompt, forget
+import contextvars
+import asyncio
+import logging
+import time
+import tts
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class GenerationPipeline:
+    """
+    Asyncio story generation with one bounded stage per remote or CPU-bound step.
+
+    LLM calls, TTS submits and the streaming download-to-mp3 transcode run in
+    threads behind their own semaphores. Submitted long-audio operations are
+    polled without holding a thread, so many can be in flight at once and
+    throughput is bounded by the TTS quota rather than by a worker count. The
+    CPU-bound encoding (including the bitrate variants and HLS segments) happens in ffmpeg
+    child processes, bounded by the transcode limit.
+    """
+
+    def __init__(
+        self,
+        llm_concurrency=PIPELINE_LLM_CONCURRENCY,
+        tts_submit_concurrency=PIPELINE_TTS_SUBMIT_CONCURRENCY,
+        tts_inflight=PIPELINE_TTS_INFLIGHT,
+        transcode_concurrency=PIPELINE_TRANSCODE_CONCURRENCY,
+        poll_interval=PIPELINE_POLL_INTERVAL,
+        tts_timeout=PIPELINE_TTS_TIMEOUT,
+    ):
+        self.limits = {
+            "llm": llm_concurrency,
+            "tts_submit": tts_submit_concurrency,
+            "tts_poll": tts_inflight,
+            "transcode": transcode_concurrency,
+            "tts_chunked": tts_inflight,
+            "renditions": transcode_concurrency,
+        }
+        self.poll_interval = poll_interval
+        self.tts_timeout = tts_timeout
+        self.stage_seconds = {stage: 0.0 for stage in self.limits}
+        self.on_stage = None  # optional callback(job_key, stage, seconds); seconds is None when the stage starts
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self.limits.items()}
+
+    def _report(self, stage, seconds=None):
+        if seconds is not None:
+            self.stage_seconds[stage] += seconds
+        if self.on_stage is not None:
+            self.on_stage(_current_job.get(), stage, seconds)
+
+    async def _stage(self, stage, func, *args):
+        async with self._semaphores[stage]:
+            self._report(stage)
+            t0 = time.monotonic()
+            try:
+                return await asyncio.to_thread(func, *args)
+            finally:
+                self._report(stage, time.monotonic() - t0)
+
+    async def _wait_for_operation(self, operation):
+        async with self._semaphores["tts_poll"]:
+            self._report("tts_poll")
+            t0 = time.monotonic()
+            try:
+                while not await asyncio.to_thread(operation.done):
+                    if time.monotonic() - t0 > self.tts_timeout:
+                        raise TimeoutError(f"TTS operation not done after {self.tts_timeout} s")
+                    await asyncio.sleep(self.poll_interval)
+                # Raises if the operation failed
+                await asyncio.to_thread(operation.result)
+            finally:
+                self._report("tts_poll", time.monotonic() - t0)
+
+    async def _synthesize(self, text, filepath):
+        if not await asyncio.to_thread(tts.restore_audio, text, filepath):
+            if tts.TTS_MODE == "chunked":
+                # Chunks are synthesized in parallel and encoded as they arrive
+                await self._stage("tts_chunked", tts.speak_chunked, text, filepath)
+            else:
+                await tts.tts_rate_limiter.acquire_async()
+                operation, filename = await self._stage("tts_submit", tts.submit, text, True)
+                await self._wait_for_operation(operation)
+                await self._stage("transcode", tts.transcode, filename, filepath)
+            await asyncio.to_thread(tts.store_audio, text, filepath)
+        try:
+            await self._stage("renditions", tts.encode_renditions, filepath)
+        except Exception as e:
+            # The story is playable without them; run.py --renditions fills the gaps later
+            logging.error(f">>> encoding renditions failed for {filepath}: {e}")
+
+    async def generate(self, model, theme, word_limit, target_group, job_key=None):
+        """Run one story through all stages; returns the LLM output. Cached stages of a job_key are skipped."""
+        _current_job.set(job_key)
+        output = await self._stage("llm", lambda: prompt(model=model, theme=theme, word_limit=word_limit, target_group=target_group, job_key=job_key))
+        if not output:
+            raise RuntimeError(f"LLM returned no story for {theme}")
+
+        filepath = story_path(theme, output["title"])
+        await self._synthesize(output["story"], filepath)
+        if job_key:
+            forget(model, theme, word_limit, target_group, job_key)
+        return output
+
+    async def run(self, jobs, on_done=None):
+        """
+        Generate all jobs concurrently.
+
+        Args:
+            jobs: Iterable of dicts with the keyword arguments of generate()
+            on_done: Optional callback(job, result, error) called as each job finishes
+
+        Returns:
+            list: (job, result, error) per job; a failing job never aborts the others
+        """
+
+        async def run_job(job):
+            try:
+                result, error = await self.generate(**job), None
+            except Exception as e:
+                logging.error(f">>> generation failed for {job}: {e}")
+                result, error = None, e
+            if on_done is not None:
+                on_done(job, result, error)
+            return job, result, error
+
+        return await asyncio.gather(*(run_job(job) for job in jobs))
@@ -0,0 +1,109 @@
+from config import RATE_LIMIT_DB_PATH
+import threading
+import asyncio
+import sqlite3
+import time
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket shared by every process on the host through a small SQLite file.
+
+    Each acquire takes a token in one short BEGIN IMMEDIATE transaction. If the
+    bucket is empty the token is borrowed (the balance goes negative) and the
+    caller sleeps until its token is due, outside of any lock. Callers are thus
+    served in order. With the default ``capacity`` of 1 tokens are handed out
+    ``per / rate`` seconds apart, so all processes together never exceed
+    ``rate`` in any window of ``per`` seconds. A larger capacity allows bursts,
+    but then up to ``capacity - 1`` extra calls can fall into one window.
+    """
+
+    def __init__(self, name, rate, per, capacity=1, db_path=RATE_LIMIT_DB_PATH):
+        self.name = name
+        self.rate = rate
+        self.per = per
+        self.capacity = capacity
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    acquired INTEGER NOT NULL DEFAULT 0,
+                    wait_seconds REAL NOT NULL DEFAULT 0
+                )
+            """
+            )
+            conn.execute("INSERT OR IGNORE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, self.capacity, time.time()))
+        finally:
+            conn.close()
+
+    def _reserve(self, tokens=1):
+        """Take tokens from the shared bucket; returns the seconds to wait before using them."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            balance, updated = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            now = time.time()
+            balance = min(self.capacity, balance + max(0.0, now - updated) * self.rate / self.per) - tokens
+            wait = max(0.0, -balance * self.per / self.rate)
+            conn.execute(
+                "UPDATE buckets SET tokens = ?, updated = ?, acquired = acquired + ?, wait_seconds = wait_seconds + ? WHERE name = ?",
+                (balance, now, tokens, wait, self.name),
+            )
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+    def _record(self, wait):
+        with self._lock:
+            self._stats["acquired"] += 1
+            if wait > 0:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += wait
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available; returns the seconds waited."""
+        wait = self._reserve(tokens)
+        self._record(wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        """Like acquire() but waits with asyncio.sleep."""
+        wait = await asyncio.to_thread(self._reserve, tokens)
+        self._record(wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def wait_if_needed(self):
+        self.acquire()
+
+    def stats(self):
+        """Wait-time metrics of this process plus the totals of all processes."""
+        conn = self._connect()
+        try:
+            tokens, acquired, wait_seconds = conn.execute("SELECT tokens, acquired, wait_seconds FROM buckets WHERE name = ?", (self.name,)).fetchone()
+        finally:
+            conn.close()
+        with self._lock:
+            local = dict(self._stats)
+        local["mean_wait_seconds"] = local["wait_seconds"] / local["acquired"] if local["acquired"] else 0.0
+        return {"process": local, "shared": {"tokens": tokens, "acquired": acquired, "wait_seconds": wait_seconds}}
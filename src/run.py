@@ -1,54 +1,128 @@
-from config import DEFAULT_TARGET_GROUP, DEFAULT_WORD_LIMIT, DEFAULT_MODEL, AVAILABLE_THEMES, DATA_DIR
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import DEFAULT_TARGET_GROUP, DEFAULT_WORD_LIMIT, DEFAULT_MODEL, AVAILABLE_THEMES, DATA_DIR, JOB_CONCURRENCY, JOB_MAX_ATTEMPTS, PIPELINE_TRANSCODE_CONCURRENCY
+from pipeline import GenerationPipeline
+from job_queue import JobQueue, drain
+from tts import tts_rate_limiter, encode_renditions, remove_variants, remove_hls
+from metadata_service import metadata_service
+from clients import clients
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import Counter
-from generator import generate
-from itertools import product
-from mutagen.mp3 import MP3
 from pathlib import Path
 from tqdm import tqdm
+import argparse
+import asyncio
 import time
 import os
 
 
 def clean_data():
-    mp3_files = Path(DATA_DIR).rglob("*.mp3")
+    metadata_service.scan()
     total_duration = 0
-    for mp3_file in sorted(mp3_files):
-        audio = MP3(mp3_file)
-        duration_min = audio.info.length / 60
+    too_short = []
+    for entry in metadata_service.files():
+        rel_path = Path(entry.path).relative_to(DATA_DIR)
+        if entry.duration is None:
+            print(f"{rel_path}: unreadable")
+            continue
+        duration_min = entry.duration / 60
         if duration_min < 6:
             print(f"{rel_path}: {duration_min:.2f} min")
-            os.remove(mp3_file)
+            os.remove(entry.path)
+            remove_variants(entry.path)
+            remove_hls(entry.path)
+            too_short.append(entry.path)
         else:
             total_duration += duration_min
-        rel_path = mp3_file.relative_to(DATA_DIR)
+    metadata_service.remove(too_short)
     print(f"\nTotal: {total_duration/60:.1f} h")
 
 
 def count_data():
-    mp3_counts = Counter(p.parent.relative_to(DATA_DIR) for p in Path(DATA_DIR).rglob("*.mp3"))
-    for subdir, count in sorted(mp3_counts.items()):
-        print(f"{str(subdir):<20} {count} files")
+    metadata_service.scan()
+    for theme, stats in metadata_service.theme_stats().items():
+        print(f"{theme:<20} {stats['count']} files")
 
 
-def generate_story(args):
-    theme, i = args
-    return generate(model=DEFAULT_MODEL, theme=theme, word_limit=DEFAULT_WORD_LIMIT, target_group=DEFAULT_TARGET_GROUP)
+def encode_missing_renditions(workers=PIPELINE_TRANSCODE_CONCURRENCY):
+    metadata_service.scan()
+    files = [entry.path for entry in metadata_service.files()]
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(total=len(files), desc="Encoding renditions") as pbar:
+        for future in as_completed([executor.submit(encode_renditions, f) for f in files]):
+            try:
+                future.result()
+            except Exception as e:
+                print(e)
+                failed += 1
+            pbar.update(1)
+    print(f">>> renditions complete for {len(files) - failed} stories ({failed} failed)")
+
+
+def theme_counts(themes):
+    metadata_service.scan()
+    stats = metadata_service.theme_stats()
+    return {theme: stats.get(theme, {"count": 0})["count"] for theme in themes}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate stories through the durable job queue")
+    parser.add_argument("--new", type=int, default=3, help="enqueue N new stories per theme")
+    parser.add_argument("--fill", type=int, metavar="N", help="enqueue as many stories as needed to have N per theme (instead of --new)")
+    parser.add_argument("--themes", nargs="+", default=AVAILABLE_THEMES, choices=AVAILABLE_THEMES)
+    parser.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY, help="jobs in progress at once")
+    parser.add_argument("--retries", type=int, default=JOB_MAX_ATTEMPTS - 1, help="retries per job before it is marked failed")
+    parser.add_argument("--status", action="store_true", help="print the queue and exit")
+    parser.add_argument("--renditions", action="store_true", help="encode missing bitrate variants and HLS renditions of the whole library and exit")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     t0 = time.time()
+    queue = JobQueue(max_attempts=args.retries + 1)
+
+    if args.status:
+        print(f">>> jobs: {queue.counts()}")
+        for stage, total in queue.stage_timings().items():
+            print(f"    {stage:<12} {total['seconds'] / total['jobs']:.1f}s avg over {total['jobs']} jobs")
+        raise SystemExit
+
+    if args.renditions:
+        encode_missing_renditions()
+        raise SystemExit
+
     os.system("clear")
+    clients.warm_up()
+
+    # Jobs of an interrupted run are resumed before new ones are added
+    recovered = queue.recover()
+    if args.fill is not None:
+        added = sum(queue.fill(args.fill, theme_counts(args.themes), DEFAULT_MODEL, DEFAULT_WORD_LIMIT, DEFAULT_TARGET_GROUP).values())
+    else:
+        added = sum(queue.enqueue(theme, args.new, DEFAULT_MODEL, DEFAULT_WORD_LIMIT, DEFAULT_TARGET_GROUP) for theme in args.themes)
+    counts = queue.counts()
+    print(f">>> {added} jobs added, {recovered} resumed, {counts.get('pending', 0)} pending")
+
+    pipeline = GenerationPipeline()
+    done = Counter()
+    with tqdm(total=counts.get("pending", 0), desc="Generating stories") as pbar:
 
-    n = 3
-    tasks = list(product(AVAILABLE_THEMES, range(n)))
-    with ProcessPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(generate_story, task): task for task in tasks}
-        with tqdm(total=len(tasks), desc="Generating stories") as pbar:
-            for future in as_completed(futures):
-                result = future.result()
+        def on_done(job, error):
+            if error is None:
+                done["ok"] += 1
                 pbar.update(1)
-    print(f"\n>>> Completed {len(tasks)} stories")
+            elif job["attempts"] >= job["max_attempts"]:
+                done["failed"] += 1
+                pbar.update(1)
+            else:
+                done["retried"] += 1
+            pbar.set_postfix(per_hour=f"{done['ok'] / (time.time() - t0) * 3600:.0f}", failed=done["failed"], retried=done["retried"])
+
+        asyncio.run(drain(queue, pipeline, args.concurrency, on_done=on_done))
+
+    print(f"\n>>> Completed {done['ok']} stories ({done['failed']} failed, {done['retried']} retries)")
+    print("    stage busy time: " + ", ".join(f"{stage} {seconds:.0f}s" for stage, seconds in pipeline.stage_seconds.items()))
+    limiter = tts_rate_limiter.stats()["process"]
+    print(f"    tts rate limit: {limiter['waited']}/{limiter['acquired']} waited, mean {limiter['mean_wait_seconds']:.1f}s, max {limiter['max_wait_seconds']:.1f}s")
 
     count_data()
     clean_data()
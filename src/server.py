@@ -1,23 +1,64 @@
 from fastapi.responses import HTMLResponse, Response, PlainTextResponse
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from fastapi.templating import Jinja2Templates
-from config import STATIC_DIR, TEMPLATES_DIR, DATA_DIR
+from config import DATA_DIR, ICON_SIZES, ICON_CACHE_MAX_AGE, HOT_CACHE_SEED_TOP, JOBS_DATABASE_PATH
 from fastapi.staticfiles import StaticFiles
+from catalog_service import catalog_service
+from asset_service import asset_service
+from ingest_service import ingest_service
+from coordination_service import coordination_service
 from audio_service import audio_service
 from auth_service import auth_service
-from db_service import db_service
+from db_service import db_service, async_db_service
 from icon_service import icon_service
+from hot_cache_service import hot_cache_service
+from metrics_service import MetricsMiddleware, Counter, Gauge, metrics_service, snapshot
+from job_queue import JobQueue
+from contextlib import asynccontextmanager
+from http_cache import etag_matches, not_modified
 from dotenv import load_dotenv
+from pathlib import Path
 import argparse
+import anyio
 import uvicorn
 
 load_dotenv()
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-app.mount("/data", StaticFiles(directory=str(DATA_DIR)), name="data")
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up in-memory indexes on startup and stop background workers on shutdown."""
+    # Decides whether this worker scans the catalog and writes playtime or follows the leader
+    coordination_service.start()
+    await anyio.to_thread.run_sync(catalog_service.start)
+    ingest_service.start()
+    await anyio.to_thread.run_sync(icon_service.warm)
+    await anyio.to_thread.run_sync(asset_service.warm)
+    if hot_cache_service.enabled:
+        top_stories = await async_db_service.get_top_stories(HOT_CACHE_SEED_TOP)
+        await anyio.to_thread.run_sync(audio_service.warm_hot_cache, top_stories)
+    yield
+    ingest_service.stop()
+    coordination_service.stop()
+    catalog_service.stop()
+    hot_cache_service.close()
+    async_db_service.shutdown()
+    db_service.pool.close_all()
+
+
+class DataFiles(StaticFiles):
+    """The story library; hidden directories in it (content and icon caches, coordination state, HLS renditions) and the SQLite databases are not published."""
+
+    async def get_response(self, path: str, scope):
+        suffix = Path(path).suffix.lower()
+        if any(part.startswith(".") for part in Path(path).parts) or suffix == ".db" or suffix.startswith(".db-"):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.mount("/data", DataFiles(directory=str(DATA_DIR)), name="data")
 
 # Authentication
 security = HTTPBasic()
@@ -31,19 +72,19 @@ def verify_admin(credentials: HTTPBasicCredentials = Depends(security)):
 @app.get("/", response_class=HTMLResponse)
 async def main(request: Request):
     """Serve the main application page."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return asset_service.response(request, asset_service.page("index.html"))
 
 
 @app.get("/impressum", response_class=HTMLResponse)
 async def impressum(request: Request):
     """Serve the impressum/legal page."""
-    return templates.TemplateResponse("impressum.html", {"request": request})
+    return asset_service.response(request, asset_service.page("impressum.html"))
 
 
 @app.get("/about", response_class=HTMLResponse)
 async def about(request: Request):
     """Serve the about page."""
-    return templates.TemplateResponse("about.html", {"request": request})
+    return asset_service.response(request, asset_service.page("about.html"))
 
 
 @app.get("/ads.txt", response_class=PlainTextResponse)
@@ -52,29 +93,36 @@ async def ads_txt():
 
 
 @app.get("/robots.txt", response_class=PlainTextResponse)
-async def robots_txt():
+async def robots_txt(request: Request):
     """Serve robots.txt for search engines."""
-    try:
-        with open(STATIC_DIR / "robots.txt", "r") as f:
-            return f.read()
-    except FileNotFoundError:
+    asset = asset_service.static("robots.txt")
+    if asset is None:
         raise HTTPException(status_code=404, detail="robots.txt not found")
+    return asset_service.response(request, asset)
 
 
 @app.get("/sitemap.xml", response_class=Response)
-async def sitemap_xml():
+async def sitemap_xml(request: Request):
     """Serve sitemap.xml for search engines."""
-    try:
-        with open(STATIC_DIR / "sitemap.xml", "r") as f:
-            return Response(content=f.read(), media_type="application/xml")
-    except FileNotFoundError:
+    asset = asset_service.static("sitemap.xml")
+    if asset is None:
         raise HTTPException(status_code=404, detail="sitemap.xml not found")
+    return asset_service.response(request, asset)
+
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+async def static_file(name: str, request: Request):
+    """Serve a static asset from memory, pre-compressed; versioned URLs are cached for good."""
+    asset = asset_service.static(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset_service.static_response(request, asset)
 
 
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request):
     """Serve the admin dashboard page."""
-    return templates.TemplateResponse("admin.html", {"request": request})
+    return asset_service.response(request, asset_service.page("admin.html"))
 
 
 @app.get("/api/admin/stats/{period}")
@@ -83,7 +131,7 @@ async def get_admin_stats(period: str, username: str = Depends(verify_admin)):
     try:
         if period not in ["24h", "7d", "30d", "alltime"]:
             raise HTTPException(status_code=400, detail="Invalid period. Must be one of: 24h, 7d, 30d, alltime")
-        stats = db_service.get_playtime_stats(period)
+        stats = await async_db_service.get_playtime_stats(period)
         return stats
     except HTTPException:
         raise
@@ -91,6 +139,80 @@ async def get_admin_stats(period: str, username: str = Depends(verify_admin)):
         raise HTTPException(status_code=500, detail=f"Failed to retrieve stats: {str(e)}")
 
 
+@app.get("/api/admin/ingest")
+async def get_ingest_stats(username: str = Depends(verify_admin)):
+    """Get queue depth and backpressure counters of the playtime ingestion and this worker's role."""
+    return {**ingest_service.stats(), "coordination": coordination_service.stats()}
+
+
+@app.get("/api/admin/db")
+async def get_db_stats(username: str = Depends(verify_admin)):
+    """Get connection pool statistics of this worker."""
+    return db_service.pool_stats()
+
+
+@app.get("/api/admin/hot-cache")
+async def get_hot_cache_stats(username: str = Depends(verify_admin)):
+    """Get hit rate and size of this worker's hot-file cache."""
+    return hot_cache_service.stats()
+
+
+def _service_metrics():
+    """Expose the counters other services already keep, read at scrape time."""
+    ingest = ingest_service.stats()
+    yield snapshot(Gauge, "playtime_queue_depth", "Buffered playtime events", {(): ingest["queued"]})
+    yield snapshot(
+        Counter,
+        "playtime_events_total",
+        "Playtime events by outcome",
+        {(key,): ingest[key] for key in ("accepted", "rejected", "dropped", "received", "written", "failed")},
+        ("outcome",),
+    )
+    hot = hot_cache_service.stats()
+    yield snapshot(Counter, "hot_cache_lookups_total", "Hot-file cache lookups by result", {("hit",): hot["hits"], ("miss",): hot["misses"]}, ("result",))
+    yield snapshot(Gauge, "hot_cache_bytes", "Bytes mapped by the hot-file cache", {(): hot["bytes"]})
+    coordination = coordination_service.stats()
+    yield snapshot(Gauge, "coordination_leader", "1 if this worker is the elected writer", {(): int(coordination["leader"])})
+    yield snapshot(
+        Counter,
+        "playtime_forwarded_events_total",
+        "Playtime events handed to the leader or written directly",
+        {("leader",): coordination["forwarded"], ("direct",): coordination["written_directly"], ("unconfirmed",): coordination["unconfirmed"]},
+        ("route",),
+    )
+    pool = db_service.pool_stats()
+    yield snapshot(Gauge, "db_connections_open", "Open pooled database connections", {(): pool["open"]})
+
+
+_job_queue = None
+
+
+def _generation_metrics():
+    """Per-stage generation timings and job counts from the job queue (written by run.py, absent until it ran)."""
+    global _job_queue
+    if _job_queue is None:
+        if not JOBS_DATABASE_PATH.exists():
+            return
+        _job_queue = JobQueue()
+    timings = _job_queue.stage_timings()
+    yield snapshot(
+        Counter, "generation_stage_seconds_total", "Seconds spent per generation stage by finished jobs", {(stage,): t["seconds"] for stage, t in timings.items()}, ("stage",)
+    )
+    yield snapshot(Counter, "generation_stage_jobs_total", "Finished jobs that ran each generation stage", {(stage,): t["jobs"] for stage, t in timings.items()}, ("stage",))
+    yield snapshot(Gauge, "generation_jobs", "Generation jobs by status", {(status,): count for status, count in _job_queue.counts().items()}, ("status",))
+
+
+metrics_service.add_collector(_service_metrics)
+metrics_service.add_collector(_generation_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(username: str = Depends(verify_admin)):
+    """Expose this worker's metrics in the Prometheus text format."""
+    body = await anyio.to_thread.run_sync(metrics_service.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/api/track-playtime")
 async def track_play(data: dict):
     """Track playtime for a specific theme and title."""
@@ -106,7 +228,8 @@ async def track_play(data: dict):
         if not isinstance(duration, (int, float)) or duration <= 0:
             raise HTTPException(status_code=400, detail="Duration must be a positive number")
 
-        db_service.track_playtime(theme, title, int(duration))
+        if not ingest_service.submit(theme, title, int(duration)):
+            raise HTTPException(status_code=503, detail="Playtime queue is full", headers={"Retry-After": "1"})
         return {"status": "ok"}
     except HTTPException:
         raise
@@ -115,48 +238,58 @@ async def track_play(data: dict):
 
 
 # Dynamic icon endpoints
+def _icon_response(request: Request, data: bytes, etag: str, media_type: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ICON_CACHE_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
 @app.get("/icon/{size}.png")
-async def get_icon(size: int):
-    """Generate PNG icon of specified size."""
-    if size not in [16, 32, 48, 64, 128, 192, 256, 512]:
+async def get_icon(size: int, request: Request):
+    """Serve the pre-rendered PNG icon of specified size."""
+    if size not in ICON_SIZES:
         raise HTTPException(status_code=400, detail="Invalid icon size")
     try:
-        icon_data = icon_service.generate_icon(size, format="PNG")
-        return Response(content=icon_data, media_type="image/png")
+        icon_data, etag = icon_service.get_icon(size)
+        return _icon_response(request, icon_data, etag, "image/png")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate icon: {str(e)}")
 
 
 @app.get("/favicon.ico")
-async def get_favicon():
-    """Generate multi-resolution favicon."""
+async def get_favicon(request: Request):
+    """Serve the pre-rendered multi-resolution favicon."""
     try:
-        favicon_data = icon_service.generate_favicon()
-        return Response(content=favicon_data, media_type="image/x-icon")
+        favicon_data, etag = icon_service.get_favicon()
+        return _icon_response(request, favicon_data, etag, "image/x-icon")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate favicon: {str(e)}")
 
 
 @app.get("/api/themes")
-async def get_themes():
-    """Get all available themes and their audio files."""
+async def get_themes(request: Request):
+    """Get all available themes and their audio files from the in-memory catalog."""
     try:
-        data = db_service.get_data()
-        themes = {}
-        for item in data:
-            theme = item["theme"]
-            if theme not in themes:
-                themes[theme] = []
-            themes[theme].append({"titel": item["titel"], "path": item["path"]})
-        return themes
+        body, etag = catalog_service.snapshot()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(headers)
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve themes: {str(e)}")
 
 
-@app.get("/api/audio/{theme}/{title}")
+@app.api_route("/api/audio/{theme}/{title}", methods=["GET", "HEAD"])
 async def stream_audio(theme: str, title: str, request: Request):
-    """Stream audio files with support for HTTP Range requests."""
-    return audio_service.stream_audio_file(theme, title, request)
+    """Stream audio files with support for HTTP Range and conditional requests."""
+    return await audio_service.stream_audio_file(theme, title, request)
+
+
+@app.api_route("/api/hls/{theme}/{title}/{name}", methods=["GET", "HEAD"])
+async def stream_hls(theme: str, title: str, name: str, request: Request):
+    """Serve HLS playlists and segments with long-lived caching."""
+    return await audio_service.stream_hls_file(theme, title, name, request)
 
 
 @app.post("/api/admin/login")
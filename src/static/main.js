@@ -23,6 +23,15 @@ document.addEventListener('DOMContentLoaded', async () => {
     setupPlayerControls();
 });
 
+// Browsers with native HLS (Safari, iOS) stream segmented stories; all others use Range requests on the mp3
+function storyUrl(theme, story) {
+    const title = encodeURIComponent(story.titel);
+    if (story.hls && audioElement.canPlayType('application/vnd.apple.mpegurl')) {
+        return `/api/hls/${theme}/${title}/index.m3u8`;
+    }
+    return `/api/audio/${theme}/${title}`;
+}
+
 async function loadThemes() {
     try {
         const response = await fetch('/api/themes');
@@ -368,7 +377,7 @@ function selectRandomStory(themeIndex) {
 
     // Prepare audio but don't play
     if (themeIndex === currentThemeIndex) {
-        const audioUrl = `/api/audio/${theme}/${encodeURIComponent(story.titel)}`;
+        const audioUrl = storyUrl(theme, story);
         audioElement.src = audioUrl;
         currentTitle = story.titel;
         lastPlayedIndex = randomIndex;
@@ -405,7 +414,7 @@ function playNextStory(themeIndex) {
     }
 
     // Load and play new story
-    const audioUrl = `/api/audio/${theme}/${encodeURIComponent(story.titel)}`;
+    const audioUrl = storyUrl(theme, story);
     audioElement.src = audioUrl;
     currentTitle = story.titel;
     playStartTime = null;
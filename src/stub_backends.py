@@ -0,0 +1,249 @@
+"""
+Local stand-ins for the LLM gateway, Text-to-Speech and Cloud Storage, for offline benchmarks.
+"""
+
+import io
+import random
+import threading
+import time
+import uuid
+import wave
+from collections import deque
+from json import dumps
+from typing import NamedTuple, Optional
+import requests
+from google.api_core import exceptions
+from clients import clients
+
+
+class StubProfile(NamedTuple):
+    """Nominal latencies (seconds), failure rate and quota of the stub backends."""
+
+    llm_latency: float  # per chat completion
+    tts_submit_latency: float  # per long-audio request
+    tts_chars_per_second: float  # long-audio synthesis speed; an operation is done after len(text) / this
+    chunk_latency: float  # per synthesize_speech chunk
+    storage_latency: float  # per blob download
+    jitter: float = 0.3  # latencies vary uniformly by +/- this fraction
+    error_rate: float = 0.0  # probability that a call fails with a retryable error
+    quota: Optional[int] = None  # calls per backend and minute before it answers "quota exhausted"
+    speech_chars_per_second: float = 15.0  # length of the synthesized audio
+
+
+STUB_PROFILES = {
+    "instant": StubProfile(0.0, 0.0, float("inf"), 0.0, 0.0, jitter=0.0),
+    "realistic": StubProfile(25.0, 0.5, 20.0, 2.5, 0.3, error_rate=0.01),
+    "flaky": StubProfile(25.0, 0.5, 20.0, 2.5, 0.3, error_rate=0.1),
+    "quota": StubProfile(25.0, 0.5, 20.0, 2.5, 0.3, error_rate=0.01, quota=60),
+}
+
+
+class StubBackend:
+    """
+    Shared behaviour of the stubs: jittered latency, random failures and a per-minute quota.
+
+    All durations, including the quota window, are multiplied by ``time_scale``
+    so a long catalog fill can be simulated in minutes.
+    """
+
+    def __init__(self, profile: StubProfile, time_scale: float = 1.0, seed: Optional[int] = None):
+        self.profile = profile
+        self.time_scale = time_scale
+        self._rng = random.Random(seed)
+        self._calls = deque()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "quota_exceeded": 0}
+
+    def delay(self, seconds: float) -> float:
+        """Scaled and jittered duration of a nominal latency."""
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.profile.jitter, self.profile.jitter)
+        return max(0.0, seconds * factor * self.time_scale)
+
+    def fault(self) -> Optional[str]:
+        """
+        Account for one call and decide whether it fails.
+
+        Returns:
+            str: "quota" beyond the quota, "error" at the error rate, otherwise None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats["calls"] += 1
+            if self.profile.quota is not None:
+                while self._calls and self._calls[0] <= now - 60 * self.time_scale:
+                    self._calls.popleft()
+                if len(self._calls) >= self.profile.quota:
+                    self.stats["quota_exceeded"] += 1
+                    return "quota"
+                self._calls.append(now)
+            if self._rng.random() < self.profile.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+        return None
+
+    def health_check(self):
+        return True
+
+
+class StubResponse:
+    """The parts of requests.Response that llm._prompt uses."""
+
+    def __init__(self, status_code: int, payload: Optional[dict] = None):
+        self.status_code = status_code
+        self._payload = payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} from the stub LLM gateway", response=self)
+
+    def json(self):
+        return self._payload
+
+
+class StubLLMSession(StubBackend):
+    """Answers /v1/chat/completions like the LiteLLM gateway, with a story of word_limit words and a unique title."""
+
+    WORDS = "es war einmal ein kleiner Drache der mit seinen Freunden am Meer lebte und jeden Tag ein neues Abenteuer suchte".split()
+
+    def __init__(self, profile: StubProfile, time_scale: float = 1.0, word_limit: int = 200, seed: Optional[int] = None):
+        super().__init__(profile, time_scale, seed)
+        self.word_limit = word_limit
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        time.sleep(self.delay(self.profile.llm_latency))
+        fault = self.fault()
+        if fault is not None:
+            return StubResponse(429 if fault == "quota" else 500)
+        with self._lock:
+            words = [self._rng.choice(self.WORDS) for _ in range(self.word_limit)]
+        story = " ".join(" ".join(words[i : i + 12]).capitalize() + "." for i in range(0, len(words), 12))
+        return StubResponse(200, {"choices": [{"message": {"content": dumps({"story": story, "title": f"Stub {uuid.uuid4().hex[:12]}"})}}]})
+
+    def close(self):
+        pass
+
+
+def silent_wav(text: str, chars_per_second: float, rate: int = 24000) -> bytes:
+    """LINEAR16 mono wav of silence, as long as the text would take to speak."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(2 * int(rate * max(1.0, len(text) / chars_per_second))))
+    return buffer.getvalue()
+
+
+class StubBlob:
+    def __init__(self, storage: "StubStorageClient", name: str):
+        self.storage = storage
+        self.name = name
+
+    def open(self, mode="rb", chunk_size=None):
+        time.sleep(self.storage.delay(self.storage.profile.storage_latency))
+        with self.storage._lock:
+            data = self.storage.blobs.get(self.name)
+        if data is None:
+            raise exceptions.NotFound(f"stub blob {self.name} does not exist")
+        return io.BytesIO(data)
+
+    def delete(self):
+        with self.storage._lock:
+            self.storage.blobs.pop(self.name, None)
+
+
+class StubBucket:
+    def __init__(self, storage: "StubStorageClient"):
+        self.storage = storage
+
+    def blob(self, name: str) -> StubBlob:
+        return StubBlob(self.storage, name)
+
+
+class StubStorageClient(StubBackend):
+    """In-memory bucket holding the wav files written by StubTTSClient."""
+
+    def __init__(self, profile: StubProfile, time_scale: float = 1.0, seed: Optional[int] = None):
+        super().__init__(profile, time_scale, seed)
+        self.blobs: dict[str, bytes] = {}
+
+    def bucket(self, name: str) -> StubBucket:
+        return StubBucket(self)
+
+    def put(self, name: str, data: bytes):
+        with self._lock:
+            self.blobs[name] = data
+
+
+class StubOperation:
+    """Long-running operation that is done at a fixed time and then succeeds or fails."""
+
+    def __init__(self, done_at: float, error: Optional[Exception] = None):
+        self.done_at = done_at
+        self.error = error
+
+    def done(self) -> bool:
+        return time.monotonic() >= self.done_at
+
+    def result(self, timeout=None):
+        remaining = self.done_at - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("stub TTS operation did not finish in time")
+        time.sleep(max(0.0, remaining))
+        if self.error is not None:
+            raise self.error
+        return None
+
+
+class StubTTSClient(StubBackend):
+    """Long-audio synthesis: the silent wav is put into the stub bucket at once, the operation is done after the synthesis time."""
+
+    def __init__(self, storage: StubStorageClient, profile: StubProfile, time_scale: float = 1.0, seed: Optional[int] = None):
+        super().__init__(profile, time_scale, seed)
+        self.storage = storage
+
+    def synthesize_long_audio(self, request):
+        time.sleep(self.delay(self.profile.tts_submit_latency))
+        fault = self.fault()
+        if fault == "quota":
+            raise exceptions.ResourceExhausted("stub TTS quota exhausted")
+        text = request.input.text
+        done_at = time.monotonic() + self.delay(len(text) / self.profile.tts_chars_per_second)
+        if fault == "error":
+            # Failures of long-audio jobs surface when the result is fetched
+            return StubOperation(done_at, exceptions.InternalServerError("stub TTS operation failed"))
+        self.storage.put(request.output_gcs_uri.rsplit("/", 1)[-1], silent_wav(text, self.profile.speech_chars_per_second))
+        return StubOperation(done_at)
+
+
+class StubTTSShortClient(StubBackend):
+    """Chunk synthesis (synthesize_speech) returning silent wav audio."""
+
+    def synthesize_speech(self, input, voice=None, audio_config=None):
+        time.sleep(self.delay(self.profile.chunk_latency))
+        fault = self.fault()
+        if fault == "quota":
+            raise exceptions.ResourceExhausted("stub TTS quota exhausted")
+        if fault == "error":
+            raise exceptions.ServiceUnavailable("stub TTS unavailable")
+        return type("SynthesizeSpeechResponse", (), {"audio_content": silent_wav(input.text, self.profile.speech_chars_per_second)})()
+
+
+def install(profile: StubProfile, time_scale: float = 1.0, word_limit: int = 200, seed: Optional[int] = None) -> dict[str, StubBackend]:
+    """
+    Route clients to stub backends (undo with clients.use(http=None, tts=None, tts_short=None, storage=None)).
+
+    Returns:
+        dict: client name -> stub, e.g. to read their call and error counters
+    """
+    storage = StubStorageClient(profile, time_scale, seed)
+    stubs = {
+        "http": StubLLMSession(profile, time_scale, word_limit, seed),
+        "tts": StubTTSClient(storage, profile, time_scale, seed),
+        "tts_short": StubTTSShortClient(profile, time_scale, seed),
+        "storage": storage,
+    }
+    clients.use(**{name: (lambda stub=stub: stub) for name, stub in stubs.items()})
+    return stubs
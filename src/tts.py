@@ -1,81 +1,331 @@
+from config import (
+    TTS_RATE_LIMIT,
+    TTS_TIME_WINDOW,
+    TTS_STREAM_CHUNK_SIZE,
+    TTS_VOICE_LANGUAGE,
+    TTS_VOICE_NAME,
+    TTS_MODE,
+    TTS_CHUNK_MAX_BYTES,
+    TTS_CHUNK_CONCURRENCY,
+    AUDIO_VARIANTS,
+    HLS_ENABLED,
+    HLS_SEGMENT_SECONDS,
+    HLS_FFMPEG_ARGS,
+)
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import TokenBucketRateLimiter
+from content_cache import content_cache
 from google.api_core import exceptions
 from google.cloud import texttospeech
-from google.cloud import storage
-from pydub import AudioSegment
-from datetime import datetime
-import threading
+from clients import clients
+import subprocess
+import hashlib
+import shutil
+import tempfile
+import logging
+import wave
 import uuid
 import time
+import io
 import os
+import re
 
+# Rate limiter for Google TTS API, shared by all processes
+tts_rate_limiter = TokenBucketRateLimiter("tts", rate=TTS_RATE_LIMIT, per=TTS_TIME_WINDOW)
 
-# Rate limiter for Google TTS API
-class RateLimiter:
-    def __init__(self, max_requests=90, time_window=60):
-        self.max_requests = max_requests
-        self.time_window = time_window
-        self.requests = []
-        self.lock = threading.Lock()
 
-    def wait_if_needed(self):
-        with self.lock:
-            now = datetime.now()
-            # Remove old requests outside time window
-            self.requests = [req_time for req_time in self.requests if (now - req_time).total_seconds() < self.time_window]
-
-            if len(self.requests) >= self.max_requests:
-                # Wait until oldest request is outside window
-                oldest = self.requests[0]
-                wait_time = self.time_window - (now - oldest).total_seconds()
-                if wait_time > 0:
-                    time.sleep(wait_time + 0.1)
-                    # Clean up after waiting
-                    now = datetime.now()
-                    self.requests = [req_time for req_time in self.requests if (now - req_time).total_seconds() < self.time_window]
-
-            self.requests.append(now)
-
-
-tts_rate_limiter = RateLimiter(max_requests=90, time_window=60)
-
-
-def speak(text, filepath):
+def submit(text, acquired=False):
+    """Start a long-audio synthesis job; returns (operation, blob_name). Pass acquired=True if a rate limit token is already held."""
     max_retries = 5
     retry_delay = 1
 
     for attempt in range(max_retries):
         try:
             # Apply rate limiting
-            tts_rate_limiter.wait_if_needed()
+            if attempt or not acquired:
+                tts_rate_limiter.wait_if_needed()
 
             # tts
             filename = f"{str(uuid.uuid4()).replace('-', '')[:32]}.wav"
-            client = texttospeech.TextToSpeechLongAudioSynthesizeClient()
+            client = clients.tts
             input = texttospeech.SynthesisInput(text=text)
             audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.LINEAR16)
-            voice = texttospeech.VoiceSelectionParams(language_code="de-DE", name="de-DE-Chirp3-HD-Leda")
+            voice = texttospeech.VoiceSelectionParams(language_code=TTS_VOICE_LANGUAGE, name=TTS_VOICE_NAME)
             parent = f"projects/zalazium-gmbh/locations/us-central1"
             request = texttospeech.SynthesizeLongAudioRequest(parent=parent, input=input, audio_config=audio_config, voice=voice, output_gcs_uri=f"gs://zalazium/{filename}")
             operation = client.synthesize_long_audio(request=request)
-            result = operation.result(timeout=600)
-            break  # Success, exit retry loop
+            return operation, filename
         except exceptions.ResourceExhausted as e:
             if attempt < max_retries - 1:
                 wait_time = retry_delay * (2**attempt)  # Exponential backoff
-                print(f"Rate limit hit, retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
+                logging.warning(f">>> TTS rate limit hit, retrying in {wait_time} seconds (attempt {attempt + 1}/{max_retries})")
                 time.sleep(wait_time)
             else:
                 raise
 
-    # download from bucket and delete
-    storage_client = storage.Client()
-    bucket = storage_client.bucket("zalazium")
+
+def _encode_stream(chunks, mp3_path, input_args, label):
+    """Pipe byte chunks into ffmpeg and write the mp3 atomically (via a .part file)."""
+    part_path = f"{mp3_path}.part"
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *input_args, "-i", "pipe:0", "-f", "mp3", part_path], stdin=subprocess.PIPE, stderr=stderr
+        )
+        try:
+            try:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early; reported below
+            finally:
+                process.stdin.close()
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"ffmpeg failed for {label}: {stderr.read().decode(errors='replace').strip()}")
+            os.replace(part_path, mp3_path)
+        except BaseException:
+            process.kill()
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+    return mp3_path
+
+
+def transcode(filename, mp3_path, chunk_size=TTS_STREAM_CHUNK_SIZE):
+    """Stream the synthesized wav from the bucket through ffmpeg into an mp3 and delete the blob; no wav is written."""
+    bucket = clients.storage.bucket("zalazium")
     blob = bucket.blob(filename)
-    blob.download_to_filename(filepath)
+
+    def read_blob():
+        with blob.open("rb", chunk_size=chunk_size) as reader:
+            while chunk := reader.read(chunk_size):
+                yield chunk
+
+    _encode_stream(read_blob(), mp3_path, ["-f", "wav"], filename)
     blob.delete()
+    return mp3_path
+
+
+def split_text(text, max_bytes=TTS_CHUNK_MAX_BYTES):
+    """Split text at paragraph and sentence boundaries into chunks of at most max_bytes (UTF-8)."""
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        new_paragraph = True
+        for sentence in re.split(r"(?<=[.!?…])\s+", paragraph.strip()):
+            # A single overlong sentence is split between words
+            while len(sentence.encode()) > max_bytes:
+                cut = sentence.rfind(" ", 0, max_bytes // 4)
+                cut = cut if cut > 0 else max_bytes // 4
+                sentences.append((sentence[:cut], new_paragraph))
+                sentence, new_paragraph = sentence[cut:].lstrip(), False
+            if sentence:
+                sentences.append((sentence, new_paragraph))
+                new_paragraph = False
+
+    chunks, current = [], ""
+    for sentence, new_paragraph in sentences:
+        candidate = f"{current}{chr(10) * 2 if new_paragraph else ' '}{sentence}" if current else sentence
+        if current and len(candidate.encode()) > max_bytes:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def variant_path(mp3_path, variant):
+    """Path of a lower-bitrate variant of a story, in <theme>/.variants/<variant>/ (hidden from the catalog)."""
+    directory, name = os.path.split(mp3_path)
+    return os.path.join(directory, ".variants", variant, f"{os.path.splitext(name)[0]}.{AUDIO_VARIANTS[variant]['ext']}")
+
+
+def _is_current(path, source_mtime_ns):
+    """True if path exists and was written after its source (a story overwritten under the same title makes it stale)."""
+    try:
+        return os.stat(path).st_mtime_ns >= source_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def encode_variants(mp3_path, variants=None, overwrite=False):
+    """Encode the missing or stale variants of a story in one ffmpeg run, so the mp3 is decoded only once; returns the paths written."""
+    source_mtime_ns = os.stat(mp3_path).st_mtime_ns
+    variants = [variant for variant in (variants or AUDIO_VARIANTS) if overwrite or not _is_current(variant_path(mp3_path, variant), source_mtime_ns)]
+    if not variants:
+        return []
+
+    outputs = []
+    args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", mp3_path]
+    for variant in variants:
+        path = variant_path(mp3_path, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        outputs.append((path, f"{path}.part"))
+        args += ["-map", "0:a", *AUDIO_VARIANTS[variant]["ffmpeg_args"], f"{path}.part"]
+    try:
+        result = subprocess.run(args, stdin=subprocess.DEVNULL, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed for variants of {mp3_path}: {result.stderr.decode(errors='replace').strip()}")
+        for path, part_path in outputs:
+            os.replace(part_path, path)
+    finally:
+        for _, part_path in outputs:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return [path for path, _ in outputs]
+
+
+def remove_variants(mp3_path):
+    for variant in AUDIO_VARIANTS:
+        path = variant_path(mp3_path, variant)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def hls_dir(mp3_path):
+    """Directory of a story's HLS playlist and segments, <theme>/.hls/<title>/ (hidden from the catalog)."""
+    directory, name = os.path.split(mp3_path)
+    return os.path.join(directory, ".hls", os.path.splitext(name)[0])
+
+
+def encode_hls(mp3_path, overwrite=False):
+    """
+    Segment a story into an AAC HLS rendition (index.m3u8 plus segments).
+
+    Segment names start with a hash of the mp3's size and mtime so they can be
+    cached forever; an existing rendition is only kept if its playlist refers to
+    segments of the current mp3. The rendition is built in a temporary directory
+    and moved into place, then the theme directory is touched so the catalog
+    picks it up.
+    """
+    target = hls_dir(mp3_path)
+    stat = os.stat(mp3_path)
+    version = hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+    if not overwrite:
+        try:
+            with open(os.path.join(target, "index.m3u8")) as f:
+                if f"{version}-" in f.read():
+                    return None
+        except FileNotFoundError:
+            pass
 
-    # convert to mp3 and delete old wav
-    audio = AudioSegment.from_wav(filepath)
-    mp3_path = filepath.replace(".wav", ".mp3")
-    audio.export(mp3_path, format="mp3")
-    os.remove(filepath)
+    part_dir = f"{target}.{os.getpid()}.part"
+    shutil.rmtree(part_dir, ignore_errors=True)
+    os.makedirs(part_dir)
+    try:
+        args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", mp3_path, "-map", "0:a", *HLS_FFMPEG_ARGS]
+        args += ["-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod", "-hls_segment_filename", os.path.join(part_dir, f"{version}-%05d.ts")]
+        result = subprocess.run([*args, os.path.join(part_dir, "index.m3u8")], stdin=subprocess.DEVNULL, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed for HLS of {mp3_path}: {result.stderr.decode(errors='replace').strip()}")
+        remove_hls(mp3_path)
+        os.rename(part_dir, target)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    os.utime(os.path.dirname(mp3_path))
+    return target
+
+
+def remove_hls(mp3_path):
+    shutil.rmtree(hls_dir(mp3_path), ignore_errors=True)
+
+
+def encode_renditions(mp3_path):
+    """Encode everything derived from a story's mp3: the bitrate variants and, if enabled, the HLS rendition."""
+    encode_variants(mp3_path)
+    if HLS_ENABLED:
+        encode_hls(mp3_path)
+
+
+def audio_cache_key(text):
+    return content_cache.key(TTS_VOICE_LANGUAGE, TTS_VOICE_NAME, text)
+
+
+def restore_audio(text, filepath):
+    """Copy previously synthesized audio for this exact text to filepath; returns False on a cache miss."""
+    return content_cache.get_file("tts_audio", audio_cache_key(text), filepath)
+
+
+def store_audio(text, filepath):
+    content_cache.put_file("tts_audio", audio_cache_key(text), filepath)
+
+
+def synthesize_chunk(text, max_retries=5, retry_delay=1):
+    """Synthesize one chunk to LINEAR16 wav bytes, cached by (voice, text) hash and retried on its own."""
+    key = audio_cache_key(text)
+    cached = content_cache.get("tts_chunk", key)
+    if cached is not None:
+        return cached
+
+    for attempt in range(max_retries):
+        try:
+            tts_rate_limiter.wait_if_needed()
+            response = clients.tts_short.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text),
+                voice=texttospeech.VoiceSelectionParams(language_code=TTS_VOICE_LANGUAGE, name=TTS_VOICE_NAME),
+                audio_config=texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.LINEAR16),
+            )
+            break
+        except (exceptions.ResourceExhausted, exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.InternalServerError) as e:
+            if attempt < max_retries - 1:
+                wait_time = retry_delay * (2**attempt)  # Exponential backoff
+                logging.warning(f">>> chunk synthesis failed ({e.__class__.__name__}), retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
+                time.sleep(wait_time)
+            else:
+                raise
+
+    audio = response.audio_content
+    content_cache.put("tts_chunk", key, audio)
+    return audio
+
+
+def _decode_wav(audio):
+    """Split wav bytes into ((channels, sample_width, rate), pcm frames)."""
+    with wave.open(io.BytesIO(audio)) as wav:
+        return (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), wav.readframes(wav.getnframes())
+
+
+def speak_chunked(text, filepath, max_workers=TTS_CHUNK_CONCURRENCY):
+    """Synthesize sentence/paragraph chunks concurrently and stitch their PCM in order into the mp3 at filepath."""
+    chunks = split_text(text)
+    if not chunks:
+        raise ValueError(f"no text to synthesize for {filepath}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(synthesize_chunk, chunk) for chunk in chunks]
+        try:
+            audio_format, first = _decode_wav(futures[0].result())
+
+            def frames():
+                # Chunks are written in order as soon as they are ready; their wav headers are dropped
+                yield first
+                for future in futures[1:]:
+                    chunk_format, data = _decode_wav(future.result())
+                    if chunk_format != audio_format:
+                        raise ValueError(f"chunk audio format {chunk_format} differs from {audio_format}")
+                    yield data
+
+            channels, sample_width, rate = audio_format
+            input_args = ["-f", f"s{8 * sample_width}le", "-ar", str(rate), "-ac", str(channels)]
+            return _encode_stream(frames(), filepath, input_args, filepath)
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def speak(text, filepath):
+    """Synthesize text into the mp3 at filepath (plus its variants and HLS rendition), reusing cached audio of the same text."""
+    if not restore_audio(text, filepath):
+        if TTS_MODE == "chunked":
+            speak_chunked(text, filepath)
+        else:
+            operation, filename = submit(text)
+            operation.result(timeout=600)
+            transcode(filename, filepath)
+        store_audio(text, filepath)
+    try:
+        encode_renditions(filepath)
+    except Exception as e:
+        # The story is playable without them; run.py --renditions fills the gaps later
+        logging.error(f">>> encoding renditions failed for {filepath}: {e}")
+    return filepath